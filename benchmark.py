@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import pandas as pd
+import numpy as np
+import datos
+import graficos
+import sintetico
+import escenarios
+from explosion import explode_bom, matriz_bom
+from costos import tabla_costos, index_compras
+from cubo import build_cubo
+from margenes import master_sku, utilidad, cost_breakdown, margen_tendencia
+from cartera import index_cxc, aging, top_clientes, vencido_tendencia
+
+# Benchmark del pipeline completo sobre datos sinteticos. Cada tamaño corre en
+# un proceso propio para que el pico de memoria no arrastre el del anterior.
+#
+#   python benchmark.py --filas 10000 1000000 --salida benchmark.json
+#   python benchmark.py --filas 10000 --base benchmark.json
+#
+# Con --base compara contra un resultado anterior y termina con codigo 1 si
+# alguna etapa es mas lenta que el umbral.
+
+FILAS = [10_000, 1_000_000, 10_000_000]
+
+# los libros de Excel no pasan de 1.048.576 filas y escribirlos es lento: por
+# encima de este tamaño la etapa de lectura se omite
+EXCEL_MAX = 100_000
+
+# etapas mas rapidas que esto en la base no se comparan (ruido)
+MINIMO = 0.05
+
+# escenarios por lote en la etapa de escenarios
+ESCENARIOS = 100
+
+# mismas opciones que el dashboard
+pd.set_option('mode.copy_on_write', True)
+
+
+def rss_pico():
+    # ru_maxrss viene en KB en linux y en bytes en macos
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico/2**20 if sys.platform == 'darwin' else pico/2**10
+
+
+@contextmanager
+def etapa(etapas, nombre):
+    registro = {'etapa': nombre, 'rss_pico_antes_mb': round(rss_pico(), 1)}
+    inicio = time.perf_counter()
+    yield registro
+    registro['segundos'] = round(time.perf_counter()-inicio, 4)
+    registro['rss_pico_mb'] = round(rss_pico(), 1)
+    etapas.append(registro)
+
+
+def run_pipeline(n, niveles, seed):
+    etapas = []
+
+    with etapa(etapas, 'generar') as e:
+        fuentes = sintetico.make_fuentes(n, niveles, seed)
+        e['filas'] = len(fuentes['ventas.xlsx'])
+
+    with tempfile.TemporaryDirectory() as path:
+        if n <= EXCEL_MAX:
+            with etapa(etapas, 'write_excel'):
+                sintetico.write_fuentes(fuentes, path)
+            for x in fuentes:
+                if x.endswith('.xlsx'):
+                    with etapa(etapas, 'excel:' + x) as e:
+                        fuentes[x] = pd.read_excel(os.path.join(path, x))
+                        e['filas'] = len(fuentes[x])
+
+        dd = {}
+        with etapa(etapas, 'clean_ventas') as e:
+            dd['ventas'] = datos.clean_ventas(fuentes['ventas.xlsx'])
+            e['filas'] = len(dd['ventas'])
+        with etapa(etapas, 'clean_compras') as e:
+            dd['compras'] = datos.clean_compras(fuentes['compras.xlsx'])
+            e['filas'] = len(dd['compras'])
+        with etapa(etapas, 'clean_faltantes') as e:
+            dd['faltantes'] = datos.clean_faltantes(fuentes['costo_me.xlsx'], fuentes['costo_mp.xlsx'],
+                                                    fuentes['costo_me_faltantes.xlsx'], dd['compras'])
+            e['filas'] = len(dd['faltantes'])
+        with etapa(etapas, 'clean_componentes') as e:
+            dd['componentes'] = datos.clean_componentes(fuentes['costo_me.xlsx'], fuentes['costo_mp.xlsx'],
+                                                        fuentes['costo_me_faltantes.xlsx'])
+            e['filas'] = len(dd['componentes'])
+        with etapa(etapas, 'explode_bom') as e:
+            bom = fuentes['bill_of_materials.xlsx'].iloc[:,[1,3,5]]
+            bom.columns = ['componente', 'subcomponente', 'cantidad']
+            e['filas_entrada'] = len(bom)
+            explosion = explode_bom(bom)
+            e['filas'] = explosion.matriz.nnz
+        with etapa(etapas, 'clean_bom') as e:
+            dd['bom'] = datos.clean_bom(fuentes['bill_of_materials.xlsx'])
+            e['filas'] = len(dd['bom'])
+        with etapa(etapas, 'clean_paises') as e:
+            dd['market_share'] = datos.clean_market_share(fuentes['market_share.xlsx'])
+            dd['paises'] = datos.clean_paises(fuentes['all.csv'], dd['market_share'])
+            e['filas'] = len(dd['paises'])
+        with etapa(etapas, 'clean_cxc') as e:
+            dd['cxc'] = datos.clean_cxc(fuentes['cuentas_por_cobrar.xlsx'], fuentes['condiciones.xlsx'])
+            e['filas'] = len(dd['cxc'])
+        with etapa(etapas, 'build_cubo') as e:
+            dd['cubo'] = build_cubo(dd['ventas'])
+            e['filas'] = len(dd['cubo'])
+        del fuentes
+
+        with etapa(etapas, 'compact') as e:
+            dd = {x: datos.compact(df.reset_index(drop=True), datos.CATEGORIAS.get(x, ())) for x, df in dd.items()}
+            e['mb'] = round(float(datos.memory_report(dd)['mb'].sum()), 1)
+        with etapa(etapas, 'write_snapshot'):
+            datos.write_snapshot('benchmark', dd, path)
+        with etapa(etapas, 'read_snapshot'):
+            dd = datos.read_snapshot('benchmark', path)
+
+    ventas, cubo, cxc = dd['ventas'], dd['cubo'], dd['cxc']
+    ultimo_year = max(cubo['year'])
+    marcas = list(ventas['marca'].dropna().unique())
+
+    with etapa(etapas, 'index_compras'):
+        historial = index_compras(dd['compras'])
+    with etapa(etapas, 'tabla_costos') as e:
+        tabla = tabla_costos(dd['compras'], dd['faltantes'], ventas['year'].unique(), historial)
+        e['filas'] = int(tabla.size)
+    with etapa(etapas, 'matriz_bom'):
+        explosion = matriz_bom(dd['bom'])
+    with etapa(etapas, 'master_sku') as e:
+        master = master_sku(ventas, dd['bom'])
+        e['filas'] = len(master)
+    with etapa(etapas, 'yield_utilidad') as e:
+        e['filas'] = len(utilidad(ventas, master, explosion, tabla, ultimo_year))
+    with etapa(etapas, 'yield_cost_breakdown') as e:
+        e['llamadas'] = len(marcas)
+        e['filas'] = sum(len(cost_breakdown(ventas, master, explosion, tabla, x, ultimo_year)) for x in marcas)
+    with etapa(etapas, 'margen_tendencia') as e:
+        e['llamadas'] = len(marcas)
+        e['filas'] = sum(len(margen_tendencia(ventas, master, explosion, historial, dd['faltantes'], x, 'M')) for x in marcas)
+    with etapa(etapas, 'escenarios') as e:
+        # ESCENARIOS combinaciones de choques de MP y ME en un solo lote
+        simulador = escenarios.build_simulador(ventas, cubo, master, explosion, tabla, dd['componentes'], ultimo_year)
+        lote = [{'nombre': str(x), 'choques': [{'tipo': 'MP', 'pct': x % 20}, {'tipo': 'ME', 'pct': x//20}]}
+                for x in range(ESCENARIOS)]
+        e['llamadas'] = len(lote)
+        e['filas'] = int(escenarios.evaluate(simulador, lote)[0].size)
+    with etapa(etapas, 'index_cxc') as e:
+        cartera = index_cxc(cxc)
+        e['filas'] = len(cartera.clave)
+    with etapa(etapas, 'aging_cxc') as e:
+        hoy = pd.Timestamp(sintetico.HASTA)
+        df_aging, df_top = aging(cartera, hoy), top_clientes(cartera, hoy)
+        df_vencido = vencido_tendencia(cartera, hoy)
+        e['filas'] = len(df_top)
+
+    figuras = {
+        'fig_resumen': lambda: graficos.fig_resumen(cubo),
+        'fig_pie:marca': lambda: graficos.fig_pie(cubo, 'marca', 'Ventas x marca', year=ultimo_year),
+        'fig_pie:pais': lambda: graficos.fig_pie(cubo, 'pais', 'Ventas x pais', year=ultimo_year),
+        'fig_pie:cliente': lambda: graficos.fig_pie(cubo, 'cliente', 'Ventas x cliente', year=ultimo_year),
+        'fig_cxc_vigencia': lambda: graficos.fig_cxc_vigencia(df_aging),
+        'fig_cxc_top': lambda: graficos.fig_cxc_top(df_top),
+        'fig_cxc_tendencia': lambda: graficos.fig_cxc_tendencia(df_vencido),
+        'fig_mapa': lambda: graficos.fig_mapa(graficos.mapa_marca(cubo, dd['paises'], marcas[0], ultimo_year), 'ventas'),
+        'fig_pie:articulo': lambda: graficos.fig_pie(cubo, 'articulo', 'Ventas x SKU', marca=marcas[0], year=ultimo_year),
+        'fig_costos_sku': lambda: graficos.fig_costos_sku(cost_breakdown(ventas, master, explosion, tabla, marcas[0], ultimo_year)),
+    }
+    for x, fig in figuras.items():
+        with etapa(etapas, x):
+            fig()
+
+    return {'filas': n,
+            'niveles': niveles,
+            'seed': seed,
+            'rss_pico_mb': round(rss_pico(), 1),
+            'segundos': round(sum(e['segundos'] for e in etapas if e['etapa'] not in ('generar', 'write_excel')), 4),
+            'etapas': etapas}
+
+
+def compare(resultados, base, umbral):
+    anteriores = {(r['filas'], e['etapa']): e['segundos'] for r in base['corridas'] for e in r['etapas']}
+    lentas = []
+    for r in resultados['corridas']:
+        for e in r['etapas']:
+            antes = anteriores.get((r['filas'], e['etapa']))
+            if antes is None or antes < MINIMO or e['etapa'] in ('generar', 'write_excel'):
+                continue
+            if e['segundos']/antes > umbral:
+                lentas.append({'filas': r['filas'], 'etapa': e['etapa'], 'antes': antes,
+                               'ahora': e['segundos'], 'razon': round(e['segundos']/antes, 2)})
+    return lentas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark del pipeline del dashboard con datos sinteticos')
+    parser.add_argument('--filas', type=int, nargs='+', default=FILAS)
+    parser.add_argument('--niveles', type=int, default=5, help='niveles de mezclas MP en la lista de materiales')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--salida', default='benchmark.json')
+    parser.add_argument('--base', help='resultado anterior para comparar')
+    parser.add_argument('--umbral', type=float, default=1.25, help='razon de tiempo que cuenta como regresion')
+    args = parser.parse_args(argv)
+
+    corridas = []
+    contexto = multiprocessing.get_context('spawn')
+    for n in args.filas:
+        with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as pool:
+            r = pool.submit(run_pipeline, n, args.niveles, args.seed).result()
+        corridas.append(r)
+        print('{:>12,} filas  {:>9.2f} s  {:>9.1f} MB'.format(n, r['segundos'], r['rss_pico_mb']))
+        for e in r['etapas']:
+            print('    {:<32} {:>9.3f} s  {:>9.1f} MB'.format(e['etapa'], e['segundos'], e['rss_pico_mb']))
+
+    resultados = {'fecha': pd.Timestamp.now().isoformat(timespec='seconds'),
+                  'prep_version': datos.PREP_VERSION,
+                  'python': platform.python_version(),
+                  'pandas': pd.__version__,
+                  'numpy': np.__version__,
+                  'maquina': platform.platform(),
+                  'cpus': os.cpu_count(),
+                  'corridas': corridas}
+    with open(args.salida, 'w') as f:
+        json.dump(resultados, f, indent=1)
+
+    if args.base:
+        with open(args.base) as f:
+            lentas = compare(resultados, json.load(f), args.umbral)
+        for x in lentas:
+            print('regresion: {filas:,} filas {etapa}: {antes:.3f} s -> {ahora:.3f} s (x{razon})'.format(**x))
+        return 1 if lentas else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+from collections import namedtuple
+import numpy as np
+import datos
+import graficos
+from costos import tabla_costos
+from explosion import matriz_bom
+from margenes import master_sku, utilidad, cost_breakdown
+from cubo import rollup, total
+
+# Calculos del dashboard sin streamlit: KPI, desglose de costos y tabla del mapa
+# por (marca, año). Los usa el dashboard y el precalculo en lote.
+
+Contexto = namedtuple('Contexto', ['datos', 'tabla', 'explosion', 'master'])
+
+
+def load_contexto(path='.', key=None, procesos=None):
+    dd = datos.load_datos(path, key, procesos=procesos)
+    return Contexto(dd,
+                    tabla_costos(dd['compras'], dd['faltantes'], dd['ventas']['year'].unique()),
+                    matriz_bom(dd['bom']),
+                    master_sku(dd['ventas'], dd['bom']))
+
+
+def ultimo_year(contexto):
+    return int(max(contexto.datos['cubo']['year']))
+
+
+def kpis_ventas(cubo, year):
+    # los KPI que salen solo del cubo; el dashboard los muestra antes de cargar
+    # costos y lista de materiales
+    ventas = total(cubo, 'usd', year=year)
+    ap = total(cubo, 'ap', year=year)
+    return {'ventas': float(ventas),
+            'ventas_delta': float((ventas/total(cubo, 'usd', year=year-1))-1),
+            'ap': float(ap),
+            'ap_delta': float((ap/total(cubo, 'ap', year=year-1))-1)}
+
+
+def kpi_utilidad(cubo, margenes, year):
+    df_utilidad = rollup(cubo, ['codigo'], ['cantidad'], year=year)
+    df_utilidad = df_utilidad.merge(margenes, left_on=['codigo'], right_on=['sku'], how='left')
+    return float(sum(df_utilidad.fillna(0)['cantidad']*df_utilidad.fillna(0)['margen'])+total(cubo, 'usd_negativo', year=year))
+
+
+def kpis_resumen(cubo, margenes, year):
+    return dict(kpis_ventas(cubo, year), utilidad=kpi_utilidad(cubo, margenes, year))
+
+
+def kpis_marca(cubo, marca, year):
+    # comparable marca el mismo tramo del año anterior solo respecto de la ultima
+    # fecha de ventas (ver cubo.build_cubo): la variacion vale para el ultimo año
+    ventas = total(cubo, 'usd', year=year, marca=marca)
+    # sin ventas el año anterior la variacion queda inf/nan, como en el dashboard
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = (ventas/total(cubo, 'usd', year=year-1, marca=marca, comparable=True))-1
+    return {'ventas': float(ventas), 'ventas_delta': float(delta)}
+
+
+def utilidad_year(contexto, year):
+    return utilidad(contexto.datos['ventas'], contexto.master, contexto.explosion, contexto.tabla, year)
+
+
+def breakdown(contexto, marca, year):
+    return cost_breakdown(contexto.datos['ventas'], contexto.master, contexto.explosion, contexto.tabla, marca, year)
+
+
+def mapa(contexto, marca, year):
+    return graficos.mapa_marca(contexto.datos['cubo'], contexto.datos['paises'], marca, year)
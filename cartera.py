@@ -0,0 +1,92 @@
+import pandas as pd
+import numpy as np
+from collections import namedtuple
+from costos import suma
+
+# Cuentas por cobrar: facturas con saldo pendiente agrupadas por fecha, cliente
+# y condicion de credito, con los dias vencidos a una fecha de corte.
+#
+# index_cxc indexa una vez las facturas abiertas por (cliente, dias de credito)
+# y vencimiento (fecha + dias_credito) en arreglos ordenados con sumas
+# acumuladas, como el historial de compras de costos.py. La antiguedad, el
+# vencido y los clientes de cualquier fecha de corte y limites de vigencia se
+# responden con busqueda binaria, sin recorrer todas las facturas. El saldo es
+# el pendiente actual: no hay historial de pagos, una fecha de corte pasada solo
+# excluye las facturas emitidas despues.
+
+# limites internos en dias vencidos; los extremos son abiertos
+LIMITES = [-100, -50, 0, 50, 100]
+
+# pesos por dolar del saldo pendiente
+TASA = 56
+
+Cartera = namedtuple('Cartera', ['clientes', 'credito', 'inicio', 'clave', 'dia0', 'pendiente'])
+
+
+def index_cxc(cxc):
+    cxc = cxc[(cxc['pendiente']!=0) & cxc['fecha'].notna() & cxc['dias_credito'].notna()]
+    grupos = cxc[['cliente', 'dias_credito']].astype({'cliente': str, 'dias_credito': 'int64'})
+    codigos, claves = pd.factorize(pd.MultiIndex.from_frame(grupos), sort=True)
+    dias = cxc['fecha'].to_numpy(dtype='datetime64[D]').astype('int64') + grupos['dias_credito'].to_numpy()
+    dia0 = dias.min() if len(dias) else 0
+    clave = (codigos.astype('int64') << 32) + (dias-dia0)
+    orden = np.argsort(clave, kind='stable')
+    codigos = codigos[orden]
+    pendiente = pd.Series(cxc['pendiente'].to_numpy(dtype=float)[orden]/TASA)
+    return Cartera(claves.get_level_values(0),
+                   claves.get_level_values(1).to_numpy(),
+                   np.searchsorted(codigos, np.arange(len(claves)+1)),
+                   clave[orden],
+                   dia0,
+                   pendiente.groupby(codigos).cumsum().to_numpy())
+
+
+def saldo_antes(cartera, hoy, dias):
+    # para cada fecha de corte (filas) y grupo (columnas): saldo de las facturas
+    # que vencen antes de hoy - dias y ya se emitieron a la fecha de corte
+    hoy = pd.DatetimeIndex(hoy).to_numpy(dtype='datetime64[D]').astype('int64')[:, None]
+    emitidas = hoy + cartera.credito[None, :] + 1
+    tope = np.clip(np.minimum(hoy - dias, emitidas) - cartera.dia0, -1, 2**31).astype('int64')
+    codigos = np.arange(len(cartera.clientes), dtype='int64')
+    j = np.searchsorted(cartera.clave, (codigos[None, :] << 32) + tope, side='left')
+    inicio = cartera.inicio[:-1][None, :]
+    return suma(cartera.pendiente, inicio, inicio, j)
+
+
+def buckets(cartera, hoy, limites=LIMITES):
+    # (grupo x vigencia) a una fecha de corte; la vigencia k son los dias
+    # vencidos en (limites[k-1], limites[k]]
+    cortes = [np.inf] + sorted(limites, reverse=True) + [-np.inf]
+    saldos = np.stack([saldo_antes(cartera, [hoy], np.where(np.isinf(x), np.sign(x)*2**40, x))[0] for x in cortes])
+    return np.diff(saldos, axis=0)[::-1].T
+
+
+def labels(limites=LIMITES):
+    cortes = ['-inf'] + ['{:g}'.format(x) for x in sorted(limites)] + ['inf']
+    return ['[{}, {}]'.format(a, b) for a, b in zip(cortes[:-1], cortes[1:])]
+
+
+def aging(cartera, hoy, limites=LIMITES):
+    return pd.DataFrame({'vigencia': labels(limites),
+                         'usd': buckets(cartera, hoy, limites).sum(axis=0).round(0)})
+
+
+def top_clientes(cartera, hoy, n=None):
+    # vencido y no vencido por cliente, los n con mayor saldo
+    vencido = saldo_antes(cartera, [hoy], 0)[0]
+    total = saldo_antes(cartera, [hoy], -2**40)[0]
+    dd = pd.DataFrame({'cliente': cartera.clientes, 'vencido': vencido, 'no vencido': total-vencido})
+    dd = dd.groupby('cliente', as_index=False).sum()
+    dd = dd.assign(total=dd['vencido']+dd['no vencido']).query('total != 0').sort_values(by=['total', 'cliente'], ascending=[False, True])
+    if n:
+        dd = dd.head(n)
+    dd = dd.drop(columns=['total']).melt(id_vars=['cliente'], var_name='vigencia', value_name='usd')
+    return dd[dd['usd']!=0].assign(usd=dd['usd'].round(0)).reset_index(drop=True)
+
+
+def vencido_tendencia(cartera, hasta, meses=24):
+    # saldo vencido a cada cierre de mes hasta la fecha de corte, todos los
+    # cierres en una sola busqueda
+    fechas = pd.date_range(end=pd.Timestamp(hasta), periods=meses, freq='M')
+    return pd.DataFrame({'fecha': fechas,
+                         'vencido': saldo_antes(cartera, fechas, 0).sum(axis=1).round(0)})
@@ -0,0 +1,323 @@
+import os
+import sys
+import json
+import shutil
+import sqlite3
+import argparse
+import threading
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from costos import add_faltantes
+import perfil
+
+# Motor de consultas del dashboard. Con el motor 'pandas' (el de siempre) las
+# tablas viven en memoria en cada proceso. Con 'sqlite' o 'duckdb' las ventas,
+# el cubo, las compras y las cuentas por cobrar se guardan una vez en disco en
+# CONSULTAS_DIR y las sumas de los KPI, los groupby de los graficos, los precios
+# ponderados, el maestro de SKU, los costos por año y por periodo y los saldos
+# de CxC se resuelven en SQL; varios procesos de streamlit comparten el mismo
+# archivo en vez de tener cada uno su copia, y la memoria no crece con el
+# historial de ventas.
+#
+#   DASHBOARD_MOTOR=sqlite streamlit run dashboard_ventas.py
+#   python consultas.py --motor duckdb      # arma la base antes de arrancar
+#
+# sqlite usa una base con indices por año, marca, pais, cliente y componente;
+# duckdb lee archivos Parquet (pip install duckdb). Las fechas se guardan como
+# dias desde 1970-01-01 para que ambos motores las comparen igual.
+
+MOTORES = ['pandas', 'sqlite', 'duckdb']
+
+MOTOR = os.environ.get('DASHBOARD_MOTOR', 'pandas')
+
+CONSULTAS_DIR = '.consultas'
+
+# tablas que se consultan en SQL; las demas siguen en memoria
+TABLAS = ['ventas', 'cubo', 'compras', 'cxc']
+
+EN_MEMORIA = ('faltantes', 'componentes', 'bom', 'paises')
+
+INDICES = {
+    'ventas': [['year'], ['marca']],
+    'cubo': [['year'], ['marca', 'year'], ['pais'], ['cliente'], ['codigo']],
+    'compras': [['componente', 'fecha'], ['fecha']],
+    'cxc': [['cliente'], ['fecha']],
+}
+
+Tabla = namedtuple('Tabla', ['motor', 'directorio', 'nombre', 'columnas', 'key'])
+
+local = threading.local()
+
+
+def dias(fechas):
+    return pd.Series(pd.to_datetime(fechas)).to_numpy(dtype='datetime64[D]').astype('int64')
+
+
+def to_sql_frame(dd):
+    # categoricas a texto, booleanos a 0/1 y fechas a dias
+    dd = dd.copy()
+    for col in dd.columns:
+        if isinstance(dd[col].dtype, pd.CategoricalDtype):
+            dd[col] = dd[col].astype(object).where(dd[col].notna(), None)
+        elif pd.api.types.is_bool_dtype(dd[col]):
+            dd[col] = dd[col].astype('int8')
+        elif pd.api.types.is_datetime64_any_dtype(dd[col]):
+            dd[col] = pd.Series(np.where(dd[col].isna(), np.nan, dias(dd[col])), index=dd.index).astype('Int64')
+    return dd
+
+
+def write_sqlite(tmp, tablas):
+    conexion = sqlite3.connect(os.path.join(tmp, 'datos.sqlite'))
+    try:
+        for x, dd in tablas.items():
+            dd.to_sql(x, conexion, index=False)
+            for columnas in INDICES.get(x, []):
+                conexion.execute('CREATE INDEX "{0}_{1}" ON "{0}" ({2})'.format(
+                    x, '_'.join(columnas), ', '.join('"{}"'.format(c) for c in columnas)))
+        conexion.execute('ANALYZE')
+        conexion.commit()
+    finally:
+        conexion.close()
+
+
+def write_parquet(tmp, tablas):
+    for x, dd in tablas.items():
+        # ordenado por la primera clave de indice: duckdb descarta row groups por
+        # sus estadisticas min/max
+        orden = INDICES.get(x, [[]])[0]
+        dd = dd.sort_values(by=orden, kind='stable') if orden else dd
+        dd.to_parquet(os.path.join(tmp, x + '.parquet'), index=False, row_group_size=100_000)
+
+
+def write_base(key, dd, motor=MOTOR, path='.'):
+    # se escribe en un directorio temporal y se reemplaza completo
+    destino = os.path.join(path, CONSULTAS_DIR, motor)
+    tmp = '{}.tmp{}'.format(destino, os.getpid())
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    tablas = {x: to_sql_frame(dd[x]) for x in TABLAS}
+    if motor == 'sqlite':
+        write_sqlite(tmp, tablas)
+    elif motor == 'duckdb':
+        write_parquet(tmp, tablas)
+    else:
+        raise ValueError('motor desconocido: ' + motor)
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump({'key': key,
+                   'motor': motor,
+                   'columnas': {x: list(df.columns) for x, df in tablas.items()},
+                   'fechas': {x: [c for c in dd[x].columns if pd.api.types.is_datetime64_any_dtype(dd[x][c])] for x in TABLAS}}, f)
+    shutil.rmtree(destino, ignore_errors=True)
+    try:
+        os.replace(tmp, destino)
+    except OSError:
+        # otro proceso escribio la misma base primero
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def open_base(key, motor=MOTOR, path='.'):
+    # None si la base no existe o es de otros datos
+    destino = os.path.join(path, CONSULTAS_DIR, motor)
+    try:
+        with open(os.path.join(destino, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # una base de otra version puede no tener todas las tablas
+    if manifest.get('key') != key or sorted(manifest.get('columnas', {})) != sorted(TABLAS):
+        return None
+    return {x: Tabla(motor, destino, x, tuple(manifest['columnas'][x]), key) for x in TABLAS}
+
+
+def check_motor(motor):
+    # duckdb es opcional: falla al elegir el motor y no en la primera consulta
+    if motor not in MOTORES[1:]:
+        raise ValueError('motor desconocido: {} (opciones: {})'.format(motor, ', '.join(MOTORES[1:])))
+    if motor == 'duckdb':
+        try:
+            import duckdb
+        except ImportError:
+            raise ImportError('DASHBOARD_MOTOR=duckdb necesita el paquete duckdb (pip install duckdb)') from None
+
+
+def load_base(key, cargar, motor=MOTOR, path='.'):
+    # cargar() devuelve las tablas preparadas; solo se llama si hay que armar la base
+    check_motor(motor)
+    base = open_base(key, motor, path)
+    if base is None:
+        write_base(key, cargar(), motor, path)
+        base = open_base(key, motor, path)
+    return base
+
+
+def conectar(tabla):
+    # una conexion de solo lectura por hilo y base: streamlit atiende cada
+    # sesion en su propio hilo. write_base reemplaza el directorio cuando cambian
+    # los datos; una conexion sqlite abierta seguiria leyendo el archivo borrado,
+    # asi que la clave incluye la de los datos y las conexiones viejas se cierran
+    conexiones = local.__dict__.setdefault('conexiones', {})
+    clave = (tabla.motor, tabla.directorio, tabla.key)
+    if clave not in conexiones:
+        for vieja in [x for x in conexiones if x[:2] == clave[:2]]:
+            conexiones.pop(vieja).close()
+        if tabla.motor == 'sqlite':
+            archivo = os.path.abspath(os.path.join(tabla.directorio, 'datos.sqlite'))
+            conexiones[clave] = sqlite3.connect('file:{}?mode=ro'.format(archivo), uri=True)
+        else:
+            import duckdb
+            conexion = duckdb.connect()
+            for x in TABLAS:
+                archivo = os.path.abspath(os.path.join(tabla.directorio, x + '.parquet')).replace("'", "''")
+                conexion.execute("CREATE VIEW \"{}\" AS SELECT * FROM read_parquet('{}')".format(x, archivo))
+            conexiones[clave] = conexion
+    return conexiones[clave]
+
+
+@perfil.medir()
+def query(tabla, sql, parametros=()):
+    conexion = conectar(tabla)
+    parametros = [x.item() if isinstance(x, np.generic) else x for x in parametros]
+    if tabla.motor == 'duckdb':
+        return conexion.execute(sql, parametros).df()
+    return pd.read_sql_query(sql, conexion, params=parametros)
+
+
+def columna(tabla, x):
+    # los nombres de columna van en el texto del SQL: solo los de la tabla
+    if x not in tabla.columnas:
+        raise KeyError(x)
+    return '"{}"'.format(x)
+
+
+def where(tabla, filtros, extra=()):
+    condiciones = ['{} = ?'.format(columna(tabla, x)) for x in filtros] + list(extra)
+    parametros = [int(v) if isinstance(v, (bool, np.bool_)) else v for v in filtros.values()]
+    return (' WHERE ' + ' AND '.join(condiciones) if condiciones else ''), parametros
+
+
+def rollup(tabla, por, medidas, **filtros):
+    # como cubo.rollup: sin filas con claves nulas y ordenado por las claves
+    claves = ', '.join(columna(tabla, x) for x in por)
+    sumas = ', '.join('COALESCE(SUM({0}), 0) AS {0}'.format(columna(tabla, x)) for x in medidas)
+    condicion, parametros = where(tabla, filtros, ['{} IS NOT NULL'.format(columna(tabla, x)) for x in por])
+    sql = 'SELECT {0}, {1} FROM "{2}"{3} GROUP BY {0} ORDER BY {0}'.format(claves, sumas, tabla.nombre, condicion)
+    dd = query(tabla, sql, parametros)
+    return dd.astype({x: float for x in medidas})
+
+
+def total(tabla, medida, **filtros):
+    condicion, parametros = where(tabla, filtros)
+    sql = 'SELECT COALESCE(SUM({}), 0) FROM "{}"{}'.format(columna(tabla, medida), tabla.nombre, condicion)
+    # np.float64 como pandas: dividir por un total cero da inf, no una excepcion
+    return np.float64(query(tabla, sql, parametros).iloc[0, 0])
+
+
+def valores(tabla, x, **filtros):
+    condicion, parametros = where(tabla, filtros, ['{} IS NOT NULL'.format(columna(tabla, x))])
+    sql = 'SELECT DISTINCT {0} FROM "{1}"{2} ORDER BY {0}'.format(columna(tabla, x), tabla.nombre, condicion)
+    return query(tabla, sql, parametros).iloc[:, 0].to_numpy()
+
+
+def distintos(tabla, columnas, **filtros):
+    # combinaciones distintas sin nulos, como drop_duplicates().dropna()
+    claves = ', '.join(columna(tabla, x) for x in columnas)
+    condicion, parametros = where(tabla, filtros, ['{} IS NOT NULL'.format(columna(tabla, x)) for x in columnas])
+    sql = 'SELECT DISTINCT {0} FROM "{1}"{2} ORDER BY {0}'.format(claves, tabla.nombre, condicion)
+    return query(tabla, sql, parametros)
+
+
+def sumas_precio(ventas, por, **filtros):
+    # numerador y denominador del precio ponderado de margenes.precios: solo
+    # ventas no negativas, y el monto solo de las filas con cantidad
+    claves = ', '.join(columna(ventas, x) for x in por)
+    condicion, parametros = where(ventas, filtros, ['"usd" >= 0'] + ['{} IS NOT NULL'.format(columna(ventas, x)) for x in por])
+    sql = ('SELECT {0}, SUM(CASE WHEN "cantidad" != 0 THEN "usd" END) AS "usd", SUM("cantidad") AS "cantidad" '
+           'FROM "{1}"{2} GROUP BY {0}').format(claves, ventas.nombre, condicion)
+    return query(ventas, sql, parametros).astype({'usd': float, 'cantidad': float})
+
+
+def read_fechas(tabla, dd):
+    with open(os.path.join(tabla.directorio, 'manifest.json')) as f:
+        fechas = json.load(f)['fechas'][tabla.nombre]
+    for x in fechas:
+        if x in dd:
+            dd[x] = pd.to_datetime(pd.to_numeric(dd[x]), unit='D')
+    return dd
+
+
+def cxc_abiertas(cxc):
+    # facturas con saldo pendiente para cartera.index_cxc
+    columnas = ['cliente', 'dias_credito', 'fecha', 'pendiente']
+    if isinstance(cxc, pd.DataFrame):
+        return cxc.loc[cxc['pendiente']!=0, columnas]
+    sql = 'SELECT {} FROM "cxc" WHERE "pendiente" != 0'.format(', '.join(columna(cxc, x) for x in columnas))
+    return read_fechas(cxc, query(cxc, sql))
+
+
+def costo_ultimas(compras, n, hasta=None):
+    # promedio ponderado de las ultimas n compras hasta el dia `hasta`, como
+    # costos.costo_ultimas; sin fecha, las ultimas n de todo el historial
+    condicion, parametros = ('"fecha" IS NOT NULL', []) if hasta is None else ('"fecha" <= ?', [int(hasta)])
+    sql = ('SELECT "componente", SUM("cantidad"*"costo")/SUM("cantidad") AS "costo" '
+           'FROM (SELECT "componente", "cantidad", "costo", ROW_NUMBER() OVER '
+           '(PARTITION BY "componente" ORDER BY "fecha" DESC) AS n '
+           'FROM "compras" WHERE {}) WHERE n <= ? GROUP BY "componente"').format(condicion)
+    return query(compras, sql, parametros + [n]).set_index('componente')['costo'].sort_index()
+
+
+def costo_ventana(compras, desde, hasta):
+    # promedio ponderado de las compras en los dias (desde, hasta]
+    ventana = query(compras, 'SELECT "componente", SUM("cantidad"*"costo")/SUM("cantidad") AS "costo" '
+                             'FROM "compras" WHERE "fecha" > ? AND "fecha" <= ? GROUP BY "componente"',
+                    [int(desde), int(hasta)])
+    return ventana.set_index('componente')['costo']
+
+
+def tabla_costos(compras, faltantes, years):
+    # como costos.tabla_costos, con los promedios ponderados calculados en SQL
+    ultimas = costo_ultimas(compras, 2)
+
+    years = sorted(years)
+    hasta = pd.to_datetime(['{}-12-31'.format(x) for x in years])
+    filas = [costo_ventana(compras, inicio, fin).reindex(ultimas.index)
+             for fin, inicio in zip(dias(hasta), dias(hasta - pd.DateOffset(years=1)))]
+    tabla = pd.DataFrame(filas, index=pd.Index(years, name='year'), columns=ultimas.index)
+    tabla = tabla.where(tabla.notna(), ultimas, axis=1)
+    tabla.columns.name = 'componente'
+    return add_faltantes(tabla, faltantes)
+
+
+def tabla_periodos(compras, faltantes, hasta, ventana=365, ultimas=2):
+    # como costos.tabla_periodos: ventana movil, si no las ultimas compras hasta
+    # la fecha y si no las ultimas de todo el historial
+    hasta = pd.DatetimeIndex(hasta)
+    todas = costo_ultimas(compras, ultimas)
+    filas = []
+    for fin, inicio in zip(dias(hasta), dias(hasta - pd.Timedelta(days=ventana))):
+        fila = costo_ventana(compras, inicio, fin).reindex(todas.index)
+        filas.append(fila.where(fila.notna(), costo_ultimas(compras, ultimas, fin).reindex(todas.index)))
+    tabla = pd.DataFrame(filas, index=pd.DatetimeIndex(hasta, name='fecha'), columns=todas.index)
+    tabla = tabla.where(tabla.notna(), todas, axis=1)
+    tabla.columns.name = 'componente'
+    return add_faltantes(tabla, faltantes)
+
+
+def main(argv=None):
+    # datos importa cubo, que importa este modulo
+    import datos
+    parser = argparse.ArgumentParser(description='Arma la base de consultas del dashboard')
+    parser.add_argument('--path', default='.')
+    parser.add_argument('--motor', choices=MOTORES[1:], default=MOTOR if MOTOR != 'pandas' else 'sqlite')
+    parser.add_argument('--procesos', type=int, default=None, help='procesos para leer los libros (uno por CPU)')
+    args = parser.parse_args(argv)
+
+    check_motor(args.motor)
+    key = datos.source_key(args.path)
+    write_base(key, datos.load_datos(args.path, key, procesos=args.procesos or datos.cpus()), args.motor, args.path)
+    print('base {} en {}'.format(args.motor, os.path.join(args.path, CONSULTAS_DIR, args.motor)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
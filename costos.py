@@ -0,0 +1,149 @@
+import pandas as pd
+import numpy as np
+from collections import namedtuple
+
+# Motor de costos: costo unitario efectivo de cada componente para cada año o
+# fecha de corte. El historial de compras se indexa una vez (arreglos ordenados
+# con sumas acumuladas) y cada metodo de costo se responde con busqueda binaria.
+
+OTROS = 3.44+0.23
+
+Historial = namedtuple('Historial', ['componentes', 'inicio', 'clave', 'dia0', 'cantidad', 'monto'])
+
+
+def index_compras(compras):
+    # compras ordenadas por (componente, fecha) con sumas acumuladas de cantidad
+    # y monto dentro de cada componente; clave = codigo << 32 | dia permite
+    # ubicar cualquier fecha de cualquier componente con un solo searchsorted
+    compras = compras[compras['fecha'].notna()].sort_values(by=['componente', 'fecha'])
+    codigos, componentes = pd.factorize(compras['componente'], sort=True)
+    dias = compras['fecha'].to_numpy(dtype='datetime64[D]').astype('int64')
+    dia0 = dias.min() if len(dias) else 0
+    cantidad = compras['cantidad'].to_numpy(dtype=float)
+    monto = cantidad*compras['costo'].to_numpy(dtype=float)
+    grupos = pd.Series(codigos)
+    return Historial(pd.Index(componentes, name='componente'),
+                     np.searchsorted(codigos, np.arange(len(componentes)+1)),
+                     (codigos.astype('int64') << 32) + (dias-dia0),
+                     dia0,
+                     pd.Series(cantidad).groupby(grupos).cumsum().to_numpy(),
+                     pd.Series(monto).groupby(grupos).cumsum().to_numpy())
+
+
+def posiciones(historial, fechas):
+    # para cada fecha (filas) y componente (columnas): fin exclusivo de las
+    # compras hechas hasta esa fecha inclusive
+    dias = np.asarray(pd.DatetimeIndex(fechas).to_numpy(dtype='datetime64[D]').astype('int64'))
+    dias = np.clip(dias-historial.dia0, -1, 2**31)
+    codigos = np.arange(len(historial.componentes), dtype='int64')
+    return np.searchsorted(historial.clave, (codigos[None, :] << 32) + dias[:, None], side='right')
+
+
+def suma(acumulado, inicio, i, j):
+    # suma de las filas [i, j) de un mismo componente que empieza en inicio
+    alto = np.where(j > inicio, acumulado[np.maximum(j-1, 0)], 0)
+    bajo = np.where(i > inicio, acumulado[np.maximum(i-1, 0)], 0)
+    return alto-bajo
+
+
+def promedio(historial, i, j):
+    inicio = historial.inicio[:-1][None, :]
+    cantidad = suma(historial.cantidad, inicio, i, j)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(j > i, suma(historial.monto, inicio, i, j)/cantidad, np.nan)
+
+
+def costo_ventana(historial, hasta, desde=None):
+    # promedio ponderado de las compras en (desde, hasta]; sin desde, todo el
+    # historial hasta la fecha
+    j = posiciones(historial, hasta)
+    i = historial.inicio[:-1][None, :] if desde is None else posiciones(historial, desde)
+    return pd.DataFrame(promedio(historial, i, j), index=pd.DatetimeIndex(hasta), columns=historial.componentes)
+
+
+def costo_ultimas(historial, n, hasta=None):
+    # promedio ponderado de las ultimas n compras hechas hasta la fecha; sin
+    # fecha, las ultimas n de todo el historial
+    if hasta is None:
+        j = historial.inicio[1:][None, :]
+        index = None
+    else:
+        j = posiciones(historial, hasta)
+        index = pd.DatetimeIndex(hasta)
+    i = np.maximum(historial.inicio[:-1][None, :], j-n)
+    return pd.DataFrame(promedio(historial, i, j), index=index, columns=historial.componentes)
+
+
+def add_faltantes(tabla, faltantes):
+    # componentes sin compras: costo de lista
+    faltantes = faltantes[~faltantes['componente'].isin(tabla.columns)].drop_duplicates(subset=['componente'])
+    faltantes = pd.DataFrame(np.repeat([faltantes['costo'].to_numpy()], len(tabla.index), axis=0),
+                             index=tabla.index, columns=faltantes['componente'])
+    tabla = pd.concat([tabla, faltantes], axis=1)
+    tabla.columns.name = 'componente'
+    return tabla
+
+
+def tabla_costos(compras, faltantes, years, historial=None):
+    historial = historial if historial is not None else index_compras(compras)
+    years = sorted(years)
+
+    # costo promedio ponderado por cantidad dentro de cada año, y para los años
+    # sin compras el de las dos ultimas compras
+    hasta = pd.to_datetime(['{}-12-31'.format(x) for x in years])
+    tabla = costo_ventana(historial, hasta, hasta - pd.DateOffset(years=1))
+    tabla = tabla.where(tabla.notna(), costo_ultimas(historial, 2).iloc[0], axis=1)
+    tabla.index = pd.Index(years, name='year')
+    return add_faltantes(tabla, faltantes)
+
+
+def tabla_periodos(historial, faltantes, hasta, ventana=365, ultimas=2):
+    # costo a cada fecha de corte: promedio ponderado de la ventana movil de
+    # `ventana` dias, si no las ultimas compras hasta la fecha y si no las
+    # ultimas de todo el historial
+    hasta = pd.DatetimeIndex(hasta)
+    tabla = costo_ventana(historial, hasta, hasta - pd.Timedelta(days=ventana))
+    tabla = tabla.where(tabla.notna(), costo_ultimas(historial, ultimas, hasta))
+    tabla = tabla.where(tabla.notna(), costo_ultimas(historial, ultimas).iloc[0], axis=1)
+    tabla.index.name = 'fecha'
+    return add_faltantes(tabla, faltantes)
+
+
+def costos_year(tabla, year):
+    return tabla.loc[year].rename('costo').reset_index()
+
+
+def costo_matriz(explosion, costos):
+    # costo de todos los SKU en un solo producto matriz dispersa x (costo por tipo)
+    costo = costos.set_index('componente')['costo'].reindex(explosion.componentes).fillna(0).to_numpy()
+    es_me = np.asarray(explosion.componentes.str.contains("ME"))
+    tipos = np.column_stack([~es_me, es_me]).astype(float)
+    valores = explosion.matriz @ (tipos*costo[:, None])
+    presencia = (explosion.matriz != 0) @ tipos
+    return pd.DataFrame(np.where(presencia > 0, valores, np.nan), index=explosion.skus, columns=['liquido', 'material_empaque'])
+
+
+def costo_sku(explosion, costos, master, by):
+    master = master.merge(costo_matriz(explosion, costos), left_on=['sku'], right_index=True, how='inner')
+    master = master.groupby([by], observed=True)[['liquido', 'material_empaque']].sum(min_count=1).reset_index()
+    master['otros'] = OTROS
+    return master
+
+
+def costo_periodos(explosion, tabla, master, by):
+    # como costo_sku pero para todas las fechas de corte de la tabla a la vez:
+    # un producto matriz dispersa x (componentes x fechas) por tipo de costo
+    costo = tabla.reindex(columns=explosion.componentes).fillna(0).to_numpy().T
+    es_me = np.asarray(explosion.componentes.str.contains("ME"))
+    presencia = (explosion.matriz != 0) @ np.column_stack([~es_me, es_me]).astype(float)
+    liquido = np.where(presencia[:, [0]] > 0, explosion.matriz @ (costo*~es_me[:, None]), np.nan)
+    material_empaque = np.where(presencia[:, [1]] > 0, explosion.matriz @ (costo*es_me[:, None]), np.nan)
+
+    costos = pd.DataFrame({'sku': np.repeat(explosion.skus, len(tabla.index)),
+                           'fecha': np.tile(tabla.index, len(explosion.skus)),
+                           'liquido': liquido.ravel(),
+                           'material_empaque': material_empaque.ravel()})
+    master = master.merge(costos, left_on=['sku'], right_on=['sku'], how='inner')
+    master = master.groupby([by, 'fecha'], observed=True)[['liquido', 'material_empaque']].sum(min_count=1).reset_index()
+    master['otros'] = OTROS
+    return master
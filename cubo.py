@@ -0,0 +1,52 @@
+import numpy as np
+from datetime import timedelta
+import consultas
+
+# Cubo de ventas: ventas agregadas una sola vez por las dimensiones que usan los
+# KPI y graficos. Cada consulta filtra y agrupa el cubo en vez de la tabla de
+# facturas completa.
+#
+# Las consultas aceptan el cubo como DataFrame o como tabla de consultas.py; en
+# el segundo caso se resuelven en SQL.
+
+DIMENSIONES = ['year', 'trimestre', 'marca', 'pais', 'cliente', 'articulo', 'codigo', 'comparable']
+
+MEDIDAS = ['usd', 'cantidad', 'usd_positivo', 'usd_negativo', 'ap']
+
+
+def build_cubo(ventas):
+    usd = ventas['usd']
+    cubo = ventas.assign(
+        # mismo tramo del año anterior: hasta la ultima fecha menos 360 dias
+        comparable=ventas['fecha'] <= (ventas['fecha'].max()-timedelta(days=360)),
+        usd_positivo=usd.where(usd >= 0, 0),
+        usd_negativo=usd.where(usd < 0, 0),
+        ap=-usd.where((usd < 0) & (ventas['cantidad'] == 0), 0),
+    )
+    cubo = cubo.groupby(DIMENSIONES, as_index=False, dropna=False, observed=True)[MEDIDAS].sum()
+    return cubo
+
+
+def slice_cubo(cubo, **filtros):
+    mask = np.ones(len(cubo), dtype=bool)
+    for col, valor in filtros.items():
+        mask &= (cubo[col] == valor).to_numpy()
+    return cubo[mask]
+
+
+def rollup(cubo, por, medidas=MEDIDAS, **filtros):
+    if isinstance(cubo, consultas.Tabla):
+        return consultas.rollup(cubo, por, medidas, **filtros)
+    return slice_cubo(cubo, **filtros).groupby(por, as_index=False, observed=True)[medidas].sum()
+
+
+def total(cubo, medida, **filtros):
+    if isinstance(cubo, consultas.Tabla):
+        return consultas.total(cubo, medida, **filtros)
+    return slice_cubo(cubo, **filtros)[medida].sum()
+
+
+def valores(cubo, columna, **filtros):
+    if isinstance(cubo, consultas.Tabla):
+        return consultas.valores(cubo, columna, **filtros)
+    return np.sort(slice_cubo(cubo, **filtros)[columna].dropna().unique())
@@ -1,395 +1,267 @@
-import os
 import pandas as pd
 import numpy as np
 import streamlit as st
-import plotly.express as px
-import statistics
-import geojson
-import seaborn as sns
-import geopandas as gpd
-import json 
-from datetime import datetime, timedelta
+from datetime import datetime
+import datos
+from costos import tabla_costos, index_compras, OTROS
+from margenes import master_sku, utilidad, cost_breakdown, margen_tendencia
+from cartera import index_cxc, aging, top_clientes, vencido_tendencia
+from explosion import matriz_bom, MERMA_MP, MERMA_OTROS
+import graficos
+import perfil
+import calculos
+import precalculo
+import escenarios
+import consultas
+from cubo import valores
 
 st.set_page_config(page_title="Dashboard de ventas", layout="wide")
 
-@st.cache_data
-def load_xlsx(x):
-    dd = pd.read_excel(x)
-    return dd
-
-@st.cache_data
-def load_csv(x):
-    dd = pd.read_csv(x)
-    return dd
-
-@st.cache_data
-def convert_to_date(date_str):
-    try:
-        return pd.to_datetime(datetime.strptime(date_str, '%d/%m/%Y').strftime('%Y-%m-%d'))
-    except ValueError:
-        try:
-            return pd.to_datetime(datetime.strptime(date_str, '%Y-%d-%m %H:%M:%S').strftime('%Y-%m-%d'))
-        except ValueError:
-            return 'Invalid Date'
-        
-@st.cache_data
-def transform_bom(dd):
-    top_level_components = dd['componente'][dd['componente'].str.contains('MP|ME|MV')== False].unique()
-    ddx = dd[dd['componente'].isin(top_level_components)]
-    ddx.columns = ['A', 'B', 'Qx']
-    ddy = dd[~dd['componente'].isin(top_level_components) | dd['subcomponente'].isin(ddx['B'])]
-    ddy.columns = ['B', 'C', 'Qy']
-    ddz = ddx.merge(ddy, left_on=['B'], right_on=['B'], how='left')
-    ddz['Qy'] = np.where(ddz['B'].str.contains('MP'), ddz['Qy']/ddz.groupby(['A','B'], as_index=False)['Qy'].transform('sum'), ddz['Qy'])
-    ddz['Qy'] = ddz['Qy'].fillna(1)
-    ddz['Qz'] = ddz['Qx']*ddz['Qy']
-    ddz['componente'] = np.where(ddz['C'].isnull(), ddz['B'], ddz['C'])
-    ddz['cantidad'] = np.where(ddz['componente'].str.contains('MP'),ddz['Qz']/(1-0.05),ddz['Qz']/(1-0.03))
-    ddz.drop(['B','Qx', 'C','Qy','Qz'], axis=1, inplace=True)
-    ddz.rename(columns={"A": "sku"}, inplace=True)
-    return ddz
-      
-@st.cache_data
-def yield_utilidad():
-    master = bom.merge(ventas[['codigo', 'marca', 'articulo']].drop_duplicates().dropna(how='any').rename(columns={'codigo':'sku',
-                                                                                                                   'articulo':'descripcion'}), left_on=['sku'], right_on=['sku'], how='left')
-    master.dropna(how='any', inplace=True)
-
-    if master.shape[0]==0:
-        return pd.DataFrame(columns=['sku','variable', 'value'])
-    
-    costos_year = compras[compras['fecha'].dt.year==max(ventas['year'])]
-    costos_year['prop'] = costos_year['cantidad']/costos_year.groupby(['componente'], as_index=False)['cantidad'].transform('sum')
-    costos_year['costo'] = costos_year['costo']*costos_year['prop']
-    costos_year = costos_year[['componente', 'costo']].groupby(['componente'], as_index=False).agg('sum')
-    costos_year['method'] = str("year")
-
-    costos_slice = compras.sort_values(by=['componente','fecha'], ascending=False).drop(['fecha'], axis=1).groupby(['componente'], as_index=False).head(2)
-    costos_slice['prop'] = costos_slice['cantidad']/costos_slice.groupby(['componente'], as_index=False)['cantidad'].transform('sum')
-    costos_slice['costo'] = costos_slice['costo']*costos_slice['prop']
-    costos_slice = costos_slice[['componente', 'costo']].groupby(['componente'], as_index=False).agg('sum')
-    costos_slice['method'] = str("slice")
-
-    costos = pd.concat([costos_year, costos_slice])
-    costos = costos.pivot(index='componente', columns='method', values='costo').reset_index(drop=False)
-    costos['costo'] = np.where(costos['year'].isnull(), costos['slice'], costos['year'])
-    costos.drop(['slice','year'], axis=1, inplace=True)
-    costos = pd.concat([costos, faltantes[~faltantes['componente'].isin(costos['componente'])]])
-
-    precios = ventas[ventas['year']==max(ventas['year'])]
-    precios = precios[precios['usd']>=0]
-    precios['prop'] = precios['cantidad']/precios.groupby(['codigo'], as_index=False)['cantidad'].transform('sum')
-    precios['precio'] = (precios['usd']/precios['cantidad'])*precios['prop']
-    precios = precios.rename(columns={'codigo':'sku'})
-    precios.dropna(how='any', inplace=True)
-    precios = precios[['sku', 'precio']].groupby(['sku'], as_index=False).agg('sum')
-
-    master = master.merge(costos, left_on=['componente'], right_on=['componente'], how='left')
-    master['tipo'] = np.where(master['componente'].str.contains("ME"), "material_empaque", "liquido")
-    master['costo'] = master['costo']*master['cantidad']
-    master = master[['sku','tipo','costo']].groupby(['sku','tipo'], as_index=False).agg('sum')
-    master = master.pivot(index='sku', columns='tipo', values='costo').reset_index()
-    master['otros'] = 3.44+0.23
-    master = master.merge(precios, left_on=['sku'], right_on=['sku'], how='left')
-    master['margen'] = master['precio']-master['material_empaque']-master['liquido']-master['otros']
-    master = master[['sku','margen']].dropna(how='any')
-    
-    return master
-
-
-@st.cache_data
-def yield_cost_breakdown(marca, year):
-
-    master = bom.merge(ventas[['codigo', 'marca', 'articulo']].drop_duplicates().dropna(how='any').rename(columns={'codigo':'sku',
-                                                                                                                   'articulo':'descripcion'}), left_on=['sku'], right_on=['sku'], how='left')
-    master.dropna(how='any', inplace=True)
-    master = master[master['marca']==marca]
-
-    if master.shape[0]==0:
-        return pd.DataFrame(columns=['descripcion','variable', 'value'])
-    
-    costos_year = compras[compras['fecha'].dt.year==year]
-    costos_year['prop'] = costos_year['cantidad']/costos_year.groupby(['componente'], as_index=False)['cantidad'].transform('sum')
-    costos_year['costo'] = costos_year['costo']*costos_year['prop']
-    costos_year = costos_year[['componente', 'costo']].groupby(['componente'], as_index=False).agg('sum')
-    costos_year['method'] = str("year")
-
-    costos_slice = compras.sort_values(by=['componente','fecha'], ascending=False).drop(['fecha'], axis=1).groupby(['componente'], as_index=False).head(2)
-    costos_slice['prop'] = costos_slice['cantidad']/costos_slice.groupby(['componente'], as_index=False)['cantidad'].transform('sum')
-    costos_slice['costo'] = costos_slice['costo']*costos_slice['prop']
-    costos_slice = costos_slice[['componente', 'costo']].groupby(['componente'], as_index=False).agg('sum')
-    costos_slice['method'] = str("slice")
-
-    costos = pd.concat([costos_year, costos_slice])
-    costos = costos.pivot(index='componente', columns='method', values='costo').reset_index(drop=False)
-    costos['costo'] = np.where(costos['year'].isnull(), costos['slice'], costos['year'])
-    costos.drop(['slice','year'], axis=1, inplace=True)
-    costos = pd.concat([costos, faltantes[~faltantes['componente'].isin(costos['componente'])]])
-
-    precios = ventas[ventas['year']==year]
-    precios = precios[precios['usd']>=0]
-    precios['prop'] = precios['cantidad']/precios.groupby(['articulo'], as_index=False)['cantidad'].transform('sum')
-    precios['precio'] = (precios['usd']/precios['cantidad'])*precios['prop']
-    precios = precios.rename(columns={'articulo':'descripcion'})
-    precios.dropna(how='any', inplace=True)
-    precios = precios[['descripcion', 'precio']].groupby(['descripcion'], as_index=False).agg('sum')
-
-    master = master.merge(costos, left_on=['componente'], right_on=['componente'], how='left')
-    master['tipo'] = np.where(master['componente'].str.contains("ME"), "material_empaque", "liquido")
-    master['costo'] = master['costo']*master['cantidad']
-    master = master[['descripcion','tipo','costo']].groupby(['descripcion','tipo'], as_index=False).agg('sum')
-    master = master.pivot(index='descripcion', columns='tipo', values='costo').reset_index()
-    master['otros'] = 3.44+0.23
-    master = master.merge(precios, left_on=['descripcion'], right_on=['descripcion'], how='left')
-    master['margen'] = master['precio']-master['material_empaque']-master['liquido']-master['otros']
-    master.drop(['precio'], axis=1, inplace=True)
-    master.dropna(how='any', inplace=True)
-    master = master.melt(id_vars=['descripcion'])
-    master['value'] = master['value'].round(2)
-    return master
-
-
-## IMPLEMENTAR ALPHAVANTAGE/TIINGO
-
-monedas = pd.DataFrame(
-    {'moneda': ['usd', 'eur', 'rd', 'dkk', 'czk', 'sek', 'jpy', 'cnh', 'chf', 'gbp'], 
-     'conversion': [1, 1.05, 0.018, 0.14, 0.043, 0.091, 0.0067, 0.136524, 1.11, 1.21]}
-)
-
-ventas = load_xlsx('ventas.xlsx')
-ventas['articulo'] = ventas['articulo'].str.lower()
-ventas = ventas[ventas['articulo'].str.contains('migraci')== False]
-ventas = ventas[ventas['codigo'].str.contains("BPT|PT", na=True)]
-ventas['fecha'] = pd.to_datetime(dict(year=ventas.year, month=ventas.month, day=ventas.day))
-ventas['trimestre'] =  ventas['fecha'].dt.to_period('Q').dt.strftime('%Y-Q%q')
-ventas.rename(columns={"familia": "marca",
-                       "monto": "usd"}, inplace=True)
-ventas['marca']=ventas['marca'].str.lower()
-ventas.loc[ventas["marca"] == "bavaro premiun", "marca"] = "bavaro"
-ventas.loc[ventas["marca"].str.contains("quorhum", na=False), "marca"] = "quorhum"
-ventas.loc[ventas["marca"].str.contains("cubaney", na=False), "marca"] = "cubaney"
-ventas.loc[ventas["marca"].str.contains("presidencial", na=False), "marca"] = "presidente"
-ventas.sort_values(by=['trimestre'], ascending=True, inplace=True)
-ventas['cliente'] = ventas['cliente'].str.lower()
-ventas.loc[ventas["cliente"].str.contains("compagnia", na=False), "cliente"] = "compagnia dei caraibi"
-ventas.loc[ventas["cliente"].str.contains("dufry", na=False), "cliente"] = "dufry"
-ventas.loc[ventas["pais"].str.contains("Russian", na=False), "pais"] = "Russia"
-ventas.loc[ventas["pais"].str.contains("USA", na=False), "pais"] = "United States of America"
-ventas.loc[ventas["pais"].str.contains("Schweiz", na=False), "pais"] = "Switzerland"
-ventas['pais'] = ventas['pais'].str.lower()
-ventas['pais'] = ventas['pais'].str.normalize('NFKD').str.encode('ascii', errors='ignore').str.decode('utf-8')
-ventas['articulo'] = ventas['articulo'].replace({'s.s.': ''}, regex=True)
-ventas['articulo'] = ventas['articulo'].replace({'ron': ''}, regex=True)
-ventas['articulo'] = ventas['articulo'].replace({'licor': ''}, regex=True)
-ventas['articulo'] = ventas['articulo'].str.replace('[().,-]', '', regex=True)
-ventas['articulo'] = ventas['articulo'].replace({'eumac': 'eu'}, regex=True)
-ventas['articulo'] = ventas['articulo'].replace({'eumo': 'eu'}, regex=True)
-ventas['articulo'] = ventas['articulo'].replace({'uemac': 'eu'}, regex=True)
-ventas['articulo'] = ventas['articulo'].replace({'spirit drink': ''}, regex=True)
-ventas['articulo'] = ventas['articulo'].replace({'spirt drink': ''}, regex=True)
-ventas['articulo'] = ventas['articulo'].replace({'ml': ''}, regex=True)
-ventas['articulo'] = ventas['articulo'].replace({'6/700': ''}, regex=True)
-ventas['articulo'] = ventas['articulo'].replace(r'\s+', ' ', regex=True)
-
-compras = load_xlsx('compras.xlsx')
-compras = compras.iloc[:, 2:9]
-compras.columns = ['fecha','proveedor','componente','descripcion','cantidad','moneda', 'costo']
-compras['fecha'] = compras['fecha'].astype(str).apply(convert_to_date)
-compras['moneda'] = compras['moneda'].str.replace(r'[^\w\s]', '', regex=True).str.lower()
-compras = compras.merge(monedas, left_on=['moneda'], right_on=['moneda'], how='left')
-compras['costo'] = compras['costo']*compras['conversion']
-compras.drop(['moneda', 'conversion' , 'descripcion'], axis=1, inplace=True)
-compras = compras[compras['componente'].str.contains("ME|MP")]
-compras.sort_values(by=['componente','fecha'], inplace=True)
-compras['prop'] = compras['cantidad'] / compras.groupby(['componente','fecha'], as_index=False)['cantidad'].transform('sum')
-compras['costo'] = compras['costo']*compras['prop']
-compras.drop(['prop','proveedor'], axis=1, inplace=True)
-compras = compras.groupby(['componente','fecha'], as_index=False).agg('sum')
-
-faltantes = pd.concat([load_xlsx('costo_me.xlsx'), load_xlsx('costo_mp.xlsx')])
-faltantes = faltantes.iloc[:,[1,10,11]]
-faltantes.columns=['componente', 'moneda', 'costo']
-faltantes = faltantes[~faltantes['componente'].isin(compras['componente'])]
-faltantes.dropna(how='any', inplace=True)
-faltantes['moneda'] = faltantes['moneda'].str.replace(r'[^\w\s]', '', regex=True).str.lower()
-faltantes_extras = load_xlsx('costo_me_faltantes.xlsx').rename(columns={"id_item": "componente",
-                                                                                       "precio": "costo"})
-faltantes_extras['componente'] = faltantes_extras['componente'].str.upper()
-faltantes_extras = faltantes_extras[~faltantes_extras['componente'].isin(faltantes['componente'])]
-faltantes = pd.concat([faltantes, faltantes_extras]).reset_index(drop=True)
-faltantes = faltantes.merge(monedas, left_on=['moneda'], right_on=['moneda'], how='left')
-faltantes['costo'] = faltantes['costo']*faltantes['conversion']
-faltantes.drop(['moneda', 'conversion'], axis=1, inplace=True)
-
-bom = load_xlsx('bill_of_materials.xlsx')
-bom = bom.iloc[:,[1,3,5]]
-bom.columns = ['componente', 'subcomponente', 'cantidad']
-bom = transform_bom(bom)
-
-market_share = load_xlsx('market_share.xlsx')
-market_share['pais'] = market_share['pais'].str.lower()
-
-cxc = load_xlsx('cuentas_por_cobrar.xlsx')
-cxc = cxc.iloc[:,1:8]
-cxc.columns = ['factura','fecha', 'codigo_cliente', 'cliente', 'facturado', 'pagado', 'pendiente']
-cxc['cliente'] = cxc['cliente'].str.lower()
-cxc.loc[cxc["cliente"].str.contains("compagnia", na=False), "cliente"] = "compagnia dei caraibi"
-cxc.loc[cxc["cliente"].str.contains("dufry", na=False), "cliente"] = "dufry"
-cxc['fecha']= cxc['fecha'].astype(str).apply(convert_to_date)
-
-condiciones = load_xlsx('condiciones.xlsx')
-condiciones = condiciones.iloc[:,[1,4]]
-condiciones.columns = ['codigo_cliente', 'dias_credito']
-condiciones['dias_credito'] = condiciones['dias_credito'].str.extract('(\d+)').fillna(0)
-condiciones['dias_credito'] = pd.to_numeric(condiciones['dias_credito'])
-
-cxc = cxc.merge(condiciones, left_on=['codigo_cliente'], right_on=['codigo_cliente'], how='left')
-
-resumen_cxc = cxc.drop(['factura','codigo_cliente'], axis=1)
-resumen_cxc = resumen_cxc[resumen_cxc['pendiente']!=0]
-resumen_cxc = resumen_cxc.groupby(['fecha','cliente','dias_credito'], as_index=False).agg('sum')
-resumen_cxc['dias_vencidos'] = (datetime.today() - resumen_cxc['fecha']).dt.days -resumen_cxc['dias_credito']
-resumen_cxc['vigencia'] = pd.cut(resumen_cxc['dias_vencidos'], 
-                                                     [-1000,-100, -50, 0, 50, 100, 1000],
-                                                     labels=['[-inf, -100]', '[-100, -50]', '[-50, 0]', '[0, 50]', '[50, 100]', '[100, inf]'])
-resumen_cxc['pendiente'] = resumen_cxc['pendiente']/56
-resumen_cxc = resumen_cxc.round(0)
-
+# los datos preparados se guardan una vez por proceso y se comparten entre
+# sesiones sin copiarlos; con copy-on-write nadie puede modificarlos en sitio
+pd.set_option('mode.copy_on_write', True)
+
+@perfil.cache(st.cache_resource)
+def load_datos(key, tablas=None):
+    return datos.load_datos(key=key, tablas=tablas)
+
+# con DASHBOARD_MOTOR=sqlite o duckdb el cubo, compras y cxc se consultan en
+# disco (ver consultas.py)
+@perfil.cache(st.cache_resource)
+def load_base(key):
+    return consultas.load_base(key, lambda: datos.load_datos(key=key))
+
+@perfil.cache(st.cache_resource)
+def load_historial(key):
+    return index_compras(compras)
+
+@perfil.cache(st.cache_resource)
+def load_costos(key):
+    if isinstance(compras, consultas.Tabla):
+        return consultas.tabla_costos(compras, faltantes, valores(cubo, 'year'))
+    return tabla_costos(compras, faltantes, valores(cubo, 'year'), load_historial(key))
+
+@perfil.cache(st.cache_resource)
+def load_explosion(key):
+    return matriz_bom(bom)
+
+@perfil.cache(st.cache_resource)
+def load_master(key):
+    return master_sku(ventas, bom)
+
+@perfil.cache(st.cache_resource, max_entries=16)
+def load_simulador(key, year):
+    return escenarios.build_simulador(ventas, cubo, load_master(key), load_explosion(key), load_costos(key),
+                                      datos_preparados['componentes'], year)
+
+# resultados de precalculo.py, si existen para estos mismos datos
+@perfil.cache(st.cache_resource)
+def load_resultados(key):
+    return precalculo.read_resultados(key)
+
+@perfil.cache(st.cache_data)
+def yield_utilidad(key):
+    return utilidad(ventas, load_master(key), load_explosion(key), load_costos(key), ultimo_year)
+
+
+@perfil.cache(st.cache_data)
+def yield_cost_breakdown(key, marca, year):
+    precalculado = precalculo.lookup(load_resultados(key), 'breakdown', marca, year)
+    if precalculado is not None:
+        return precalculado
+    return cost_breakdown(ventas, load_master(key), load_explosion(key), load_costos(key), marca, year)
+
+@perfil.cache(st.cache_data)
+def yield_kpis_resumen(key, year):
+    resultados = load_resultados(key)
+    if resultados is not None and resultados['resumen']['year'] == year:
+        return resultados['resumen']
+    return calculos.kpis_resumen(cubo, yield_utilidad(key), year)
+
+# ingresos y A&P salen solo del cubo y se muestran antes que la utilidad
+@perfil.cache(st.cache_data)
+def yield_kpis_ventas(key, year):
+    resultados = load_resultados(key)
+    if resultados is not None and resultados['resumen']['year'] == year:
+        return resultados['resumen']
+    return calculos.kpis_ventas(cubo, year)
+
+@perfil.cache(st.cache_data)
+def yield_kpis_marca(key, marca, year):
+    resultados = load_resultados(key)
+    if resultados is not None and (marca, year) in resultados['kpis']:
+        return resultados['kpis'][(marca, year)]
+    return calculos.kpis_marca(cubo, marca, year)
+
+
+# ?perfil=1 (o DASHBOARD_PERFIL=1) muestra el tiempo y memoria de cada etapa
+perfil.start(st.experimental_get_query_params().get('perfil') == ['1'])
+
+# el encabezado y el selector se dibujan antes de leer datos
 st.subheader('Dashboard')
 
-tab1, tab2 = st.tabs(["Resumen", "Marcas"])
-
-with tab1:
+# st.tabs ejecuta el cuerpo de todas las pestañas en cada rerun; con el selector
+# solo se calcula la pestaña visible
+pestaña = st.radio('Vista', ["Resumen", "Marcas", "Escenarios"], horizontal=True, label_visibility='collapsed')
+
+with perfil.span('source_key'):
+    datos_key = datos.source_key()
+
+def load_tablas(tablas):
+    # con pandas un arranque en frio arma solo los grupos del snapshot que se
+    # piden (ver datos.GRUPOS); con un motor SQL la base se arma completa, mejor
+    # antes de arrancar con python consultas.py
+    if consultas.MOTOR == 'pandas':
+        return dict(load_datos(datos_key, tablas))
+    base = load_base(datos_key)
+    return dict(load_datos(datos_key, tuple(x for x in tablas if x in consultas.EN_MEMORIA)),
+                **{x: base[x] for x in tablas if x in consultas.TABLAS})
+
+# primero solo las tablas de los KPI y graficos de ventas; costos, lista de
+# materiales y CxC se cargan despues de dibujarlos
+datos_preparados = load_tablas(('ventas', 'cubo', 'paises'))
+ventas = datos_preparados['ventas']
+cubo = datos_preparados['cubo']
+paises = datos_preparados['paises']
+
+ultimo_year = int(valores(cubo, 'year')[-1])
+
+# cada figura se construye una sola vez por combinacion de sus entradas y se
+# comparte entre sesiones
+
+@perfil.cache(st.cache_resource)
+def load_cartera(key):
+    return index_cxc(consultas.cxc_abiertas(cxc))
+
+@perfil.cache(st.cache_resource)
+def load_fig_resumen(key):
+    return graficos.fig_resumen(cubo)
+
+@perfil.cache(st.cache_resource)
+def load_fig_pie(key, dimension, title, marca=None, year=None):
+    filtros = {'year': year} if marca is None else {'year': year, 'marca': marca}
+    return graficos.fig_pie(cubo, dimension, title, **filtros)
+
+@perfil.cache(st.cache_resource, max_entries=256)
+def load_fig_cxc(key, grafico, hoy, n=None):
+    if grafico == 'vigencia':
+        return graficos.fig_cxc_vigencia(aging(load_cartera(key), hoy))
+    if grafico == 'tendencia':
+        return graficos.fig_cxc_tendencia(vencido_tendencia(load_cartera(key), hoy))
+    return graficos.fig_cxc_top(top_clientes(load_cartera(key), hoy, n))
+
+@perfil.cache(st.cache_resource, max_entries=256)
+def load_fig_mapa(key, marca, year, metrica):
+    df_marca_mapa = precalculo.lookup(load_resultados(key), 'mapa', marca, year)
+    if df_marca_mapa is None:
+        df_marca_mapa = graficos.mapa_marca(cubo, paises, marca, year)
+    return graficos.fig_mapa(df_marca_mapa, metrica)
+
+@perfil.cache(st.cache_resource, max_entries=256)
+def load_fig_costos_sku(key, marca, year):
+    return graficos.fig_costos_sku(yield_cost_breakdown(key, marca, year))
+
+@perfil.cache(st.cache_resource, max_entries=256)
+def load_fig_tendencia(key, marca, frecuencia):
+    # con un motor SQL los costos por periodo se calculan sobre la tabla de compras
+    historial = compras if isinstance(compras, consultas.Tabla) else load_historial(key)
+    df_tendencia = margen_tendencia(ventas, load_master(key), load_explosion(key), historial, faltantes, marca, frecuencia)
+    return graficos.fig_margen_tendencia(df_tendencia)
+
+def plotly_chart(nombre, fig, **kwargs):
+    # la serializacion de la figura se mide aparte de su construccion
+    with perfil.span('plotly_chart:' + nombre):
+        st.plotly_chart(fig, **kwargs)
+
+
+if pestaña == "Resumen":
     col1, col2= st.columns([1,3])
     with col1:
-        metrica_ventas_ytd = ventas['usd'][ventas['year']>=max(ventas['year'])].sum()
-        metrica_ventas_ytd_delta = (metrica_ventas_ytd/ventas['usd'][ventas['year']==(max(ventas['year'])-1)].sum())-1
+        kpis = yield_kpis_ventas(datos_key, ultimo_year)
+        metrica_ventas_ytd = kpis['ventas']
+        metrica_ventas_ytd_delta = kpis['ventas_delta']
         st.metric(label="Ingresos (YTD)", value='${:,.0f}'.format(metrica_ventas_ytd), delta='{:.0%}'.format(metrica_ventas_ytd_delta))
         st.divider()
-        df_utilidad = ventas[['codigo', 'fecha', 'usd', 'cantidad']]
-        df_utilidad = df_utilidad[(df_utilidad['fecha'].dt.year==max(df_utilidad['fecha'].dt.year))]
-        df_utilidad = df_utilidad.merge(yield_utilidad(), left_on=['codigo'], right_on=['sku'], how='left')
-        metrica_utilidad = sum(df_utilidad.fillna(0)['cantidad']*df_utilidad.fillna(0)['margen'])+sum(df_utilidad['usd'][df_utilidad['usd']<0])
-        st.metric(label="Utilidad (YTD)", value='${:,.0f}'.format(metrica_utilidad), delta=None)
+        # la utilidad necesita costos y lista de materiales: se completa al final
+        espacio_utilidad = st.empty()
+        espacio_utilidad.metric(label="Utilidad (YTD)", value='...', delta=None)
         st.divider()
-        metrica_ap_ytd = ventas['usd'][(ventas['year']>=max(ventas['year'])) & (ventas['usd']<0)  & (ventas['cantidad']==0)].sum()*(-1)
-        metrica_ap_ytd_delta = (metrica_ap_ytd/(ventas['usd'][(ventas['year']==(max(ventas['year'])-1)) & (ventas['usd']<0) & (ventas['cantidad']==0)].sum()*(-1)))-1
+        metrica_ap_ytd = kpis['ap']
+        metrica_ap_ytd_delta = kpis['ap_delta']
         st.metric(label="A&P (YTD)", value='${:,.0f}'.format(metrica_ap_ytd), delta='{:.0%}'.format(metrica_ap_ytd_delta))
     with col2:
-        df_resumen = ventas[['year','usd']]
-        df_resumen['clase'] = np.where(df_resumen['usd']<0, "a&p", "ingreso")
-        df_resumen = df_resumen.groupby(['year','clase'], as_index=False).agg('sum')
-        df_resumen['usd'] = df_resumen['usd'].abs()
-        df_resumen['porcentaje'] = (df_resumen['usd'] / df_resumen.groupby('year')['usd'].transform('sum')) * 100
-        fig_resumen = px.bar(df_resumen,
-                      y='usd',
-                      x='year',
-                      text=[f"{value:.1f}%" for value in df_resumen['porcentaje']],
-                      color='clase',
-                      height=550)
-        fig_resumen.update_layout(yaxis_title="(USD)")
-        fig_resumen.update_layout(xaxis_title=None)
-        fig_resumen.update_xaxes(type='category')
-        st.plotly_chart(fig_resumen, theme="streamlit", use_container_width=True)
+        plotly_chart('resumen', load_fig_resumen(datos_key), theme="streamlit", use_container_width=True)
     
     col3, col4, col5 = st.columns(3)
     with col3:
-        fig_resumen_marca = px.pie(ventas[['marca','usd']][ventas['year']>=max(ventas['year'])].groupby(['marca'], as_index=False).agg('sum'),
-                                  values='usd',
-                                  names='marca',
-                                  title='Ventas x marca',
-                                  hole=0.3)
-        st.plotly_chart(fig_resumen_marca, theme="streamlit", use_container_width=True)        
+        plotly_chart('marca', load_fig_pie(datos_key, 'marca', 'Ventas x marca', year=ultimo_year), theme="streamlit", use_container_width=True)
 
     with col4:
-        fig_resumen_pais = px.pie(ventas[['pais','usd']][ventas['year']>=max(ventas['year'])].groupby(['pais'], as_index=False).agg('sum'),
-                                  values='usd',
-                                  names='pais',
-                                  title='Ventas x pais',
-                                  hole=0.3)
-        st.plotly_chart(fig_resumen_pais, theme="streamlit", use_container_width=True)
-
+        plotly_chart('pais', load_fig_pie(datos_key, 'pais', 'Ventas x pais', year=ultimo_year), theme="streamlit", use_container_width=True)
 
     with col5:
-        fig_resumen_cliente = px.pie(ventas[['cliente','usd']][ventas['year']>=max(ventas['year'])].groupby(['cliente'], as_index=False).agg('sum'),
-                                  values='usd',
-                                  names='cliente',
-                                  title='Ventas x cliente',
-                                  hole=0.3)
-        st.plotly_chart(fig_resumen_cliente, theme="streamlit", use_container_width=True)
+        plotly_chart('cliente', load_fig_pie(datos_key, 'cliente', 'Ventas x cliente', year=ultimo_year), theme="streamlit", use_container_width=True)
 
-    col6, col7 = st.columns(2)
+    hoy = datetime.today().date()
+    col_corte, col_top, _ = st.columns([1,1,2])
+    with col_corte:
+        var_corte = st.date_input('Fecha de corte CxC:', hoy)
+    with col_top:
+        var_top = st.number_input('Clientes (0 = todos):', min_value=0, value=0, step=5)
 
-    with col6:
-        df_resumen_cxc_vigencia = resumen_cxc[['vigencia', 'pendiente']].groupby(['vigencia'], as_index=False).agg('sum').rename(columns={'pendiente':'usd'})
-        fig_resumen_cxc_vigencia = px.bar(df_resumen_cxc_vigencia,
-                                          x = 'usd',
-                                          y='vigencia',
-                                          title='Cuentas x cobrar x vigencia',
-                                          height=550
-                                          )
-        fig_resumen_cxc_vigencia.update_layout(xaxis_title="(USD)")
-        fig_resumen_cxc_vigencia.update_layout(yaxis_title="(dias vencidos)")
-        st.plotly_chart(fig_resumen_cxc_vigencia, use_container_width=True)
-
-    with col7:
-        df_resumen_cxc_top = resumen_cxc.copy()
-        df_resumen_cxc_top['vigencia'] = np.where(df_resumen_cxc_top['dias_vencidos']>0, str("vencido"), str("no vencido"))
-        df_resumen_cxc_top = df_resumen_cxc_top[['cliente','vigencia', 'pendiente']].groupby(['cliente', 'vigencia'], as_index=False).agg('sum').rename(columns={'pendiente':'usd'})
-        fig_resumen_cxc_top = px.bar(df_resumen_cxc_top,
-                                     x='usd',
-                                     y='cliente',
-                                     color='vigencia',
-                                     title='Cuentas x cobrar x cliente',
-                                     height=550)
-        fig_resumen_cxc_top.update_layout(xaxis_title="(USD)")
-        fig_resumen_cxc_top.update_layout(yaxis_title=None)
-        fig_resumen_cxc_top.update_layout(yaxis={'categoryorder':'total ascending'}) 
-        st.plotly_chart(fig_resumen_cxc_top, use_container_width=True)
-
-with tab2:
-    col1, col2, col3, col4, col5 = st.columns(5)
-    with col1:
-        metrica_ventas_presidente = ventas['usd'][(ventas['year']>=max(ventas['year']))&(ventas['marca']=='presidente')].sum()
-        metrica_ventas_presidente_delta = (metrica_ventas_presidente/ventas['usd'][(ventas['year']==(max(ventas['year'])-1))&(ventas['marca']=='presidente')&(ventas['fecha']<=(max(ventas['fecha'])-timedelta(days=360)))].sum())-1
-        st.metric(label="Presidente (YTD)", value='${:,.0f}'.format(round(metrica_ventas_presidente,-3)), delta='{:.0%}'.format(metrica_ventas_presidente_delta))
-    
-    with col2:
-        metrica_ventas_quorhum = ventas['usd'][(ventas['year']>=max(ventas['year']))&(ventas['marca']=='quorhum')].sum()
-        metrica_ventas_quorhum_delta = (metrica_ventas_quorhum/ventas['usd'][(ventas['year']==(max(ventas['year'])-1))&(ventas['marca']=='quorhum')&(ventas['fecha']<=(max(ventas['fecha'])-timedelta(days=360)))].sum())-1
-        st.metric(label="Quorhum (YTD)", value='${:,.0f}'.format(round(metrica_ventas_quorhum,-3)), delta='{:.0%}'.format(metrica_ventas_quorhum_delta))
-    
-    with col3:
-        metrica_ventas_opthimus = ventas['usd'][(ventas['year']>=max(ventas['year']))&(ventas['marca']=='opthimus')].sum()
-        metrica_ventas_opthimus_delta = (metrica_ventas_opthimus/ventas['usd'][(ventas['year']==(max(ventas['year'])-1))&(ventas['marca']=='opthimus')&(ventas['fecha']<=(max(ventas['fecha'])-timedelta(days=360)))].sum())-1
-        st.metric(label="Opthimus (YTD)", value='${:,.0f}'.format(round(metrica_ventas_opthimus,-3)), delta='{:.0%}'.format(metrica_ventas_opthimus_delta))
-    
-    with col4:
-        metrica_ventas_puntacana = ventas['usd'][(ventas['year']>=max(ventas['year']))&(ventas['marca']=='punta cana club')].sum()
-        metrica_ventas_puntacana_delta = (metrica_ventas_puntacana/ventas['usd'][(ventas['year']==(max(ventas['year'])-1))&(ventas['marca']=='punta cana club')&(ventas['fecha']<=(max(ventas['fecha'])-timedelta(days=360)))].sum())-1
-        st.metric(label="Punta Cana (YTD)", value='${:,.0f}'.format(round(metrica_ventas_puntacana,-3)), delta='{:.0%}'.format(metrica_ventas_puntacana_delta))
-    
-    with col5:
-        metrica_ventas_cubaney = ventas['usd'][(ventas['year']>=max(ventas['year']))&(ventas['marca']=='cubaney')].sum()
-        metrica_ventas_cubaney_delta = (metrica_ventas_cubaney/ventas['usd'][(ventas['year']==(max(ventas['year'])-1))&(ventas['marca']=='cubaney')&(ventas['fecha']<=(max(ventas['fecha'])-timedelta(days=360)))].sum())-1
-        st.metric(label="Cubaney (YTD)", value='${:,.0f}'.format(round(metrica_ventas_cubaney,-3)), delta='{:.0%}'.format(metrica_ventas_cubaney_delta))
+    col6, col7 = st.columns(2)
+    espacios_cxc = [col6.empty(), col7.empty(), st.empty()]
+    for espacio in espacios_cxc:
+        espacio.info('Cargando cuentas por cobrar...')
+
+datos_preparados.update(load_tablas(('compras', 'faltantes', 'componentes', 'bom', 'cxc')))
+compras = datos_preparados['compras']
+faltantes = datos_preparados['faltantes']
+bom = datos_preparados['bom']
+cxc = datos_preparados['cxc']
+
+if pestaña == "Resumen":
+    metrica_utilidad = yield_kpis_resumen(datos_key, ultimo_year)['utilidad']
+    espacio_utilidad.metric(label="Utilidad (YTD)", value='${:,.0f}'.format(metrica_utilidad), delta=None)
+
+    with espacios_cxc[0]:
+        plotly_chart('cxc_vigencia', load_fig_cxc(datos_key, 'vigencia', var_corte), use_container_width=True)
+
+    with espacios_cxc[1]:
+        plotly_chart('cxc_top', load_fig_cxc(datos_key, 'top', var_corte, var_top or None), use_container_width=True)
+
+    with espacios_cxc[2]:
+        plotly_chart('cxc_tendencia', load_fig_cxc(datos_key, 'tendencia', var_corte), use_container_width=True)
+
+elif pestaña == "Marcas":
+    marcas_kpi = {'presidente': 'Presidente',
+                  'quorhum': 'Quorhum',
+                  'opthimus': 'Opthimus',
+                  'punta cana club': 'Punta Cana',
+                  'cubaney': 'Cubaney'}
+    for col, (marca, nombre) in zip(st.columns(len(marcas_kpi)), marcas_kpi.items()):
+        with col:
+            kpis = yield_kpis_marca(datos_key, marca, ultimo_year)
+            metrica_ventas_marca = kpis['ventas']
+            metrica_ventas_marca_delta = kpis['ventas_delta']
+            st.metric(label="{} (YTD)".format(nombre), value='${:,.0f}'.format(round(metrica_ventas_marca,-3)), delta='{:.0%}'.format(metrica_ventas_marca_delta))
 
 
     st.title("")
 
-    year_list = ventas.year.sort_values().unique()
-    year_index=np.where(year_list==max(ventas.year))[0][0]
+    year_list = valores(cubo, 'year')
+    year_index=np.where(year_list==ultimo_year)[0][0]
 
     col1, col2= st.columns([1,3])
     with col1:
         var_year = st.selectbox(
              'Año:',
-            list(ventas.year.sort_values().unique()),
+            list(year_list),
             index=int(year_index))
         
         var_marca = st.selectbox(
              'Marca:',
-            list(ventas.marca.sort_values().unique()))
+            list(valores(cubo, 'marca')))
         
         var_metrica = st.selectbox(
              'Métrica:',
@@ -397,51 +269,77 @@ with tab2:
         
 
     with col2:
-
-        country_codes = load_csv('all.csv')
-        country_codes = country_codes[['pais', 'alpha-3']]
-        country_codes['pais'] = country_codes['pais'].str.lower()
-
-        df_marca_mapa = ventas.copy()
-        df_marca_mapa.dropna(how='any', inplace=True)
-        df_marca_mapa = df_marca_mapa[(df_marca_mapa['marca']==var_marca) & (df_marca_mapa['year']==var_year)]
-        df_marca_mapa['ventas'] = df_marca_mapa['usd'][df_marca_mapa['usd']>=0]
-        df_marca_mapa = df_marca_mapa[['marca', 'pais', 'ventas','cantidad']].groupby(['marca', 'pais'],as_index=False).agg('sum')
-        df_marca_mapa = df_marca_mapa.merge(country_codes, left_on=['pais'], right_on=['pais'], how='left')
-        df_marca_mapa = df_marca_mapa.merge(market_share, left_on=['pais'], right_on=['pais'], how='left')
-        df_marca_mapa['market_share'] = ((df_marca_mapa['cantidad']*4.2*0.4)/((df_marca_mapa['aa_per_capita']*df_marca_mapa['population'])*0.03))*100
-        df_marca_mapa['market_share'] = df_marca_mapa['market_share'].round(3)
-
-        fig_marca_mapa = px.choropleth(df_marca_mapa, locations="alpha-3", color=var_metrica,
-                                       color_continuous_scale=px.colors.sequential.PuBu,
-                                       hover_name="pais",
-                                       width=1010)
-        
-        fig_marca_mapa.update_geos(projection_type="natural earth")
-        fig_marca_mapa.update_geos(lataxis_showgrid=True, lonaxis_showgrid=True)
-        fig_marca_mapa.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
-        fig_marca_mapa.update_layout(mapbox_style="carto-positron", mapbox_zoom=2, mapbox_center={"lat": 51, "lon": 10})    
-        fig_marca_mapa.update_layout(title_text="European Sales Choropleth Map", geo=dict(showcoastlines=True))    
-
-        st.plotly_chart(fig_marca_mapa)   
+        plotly_chart('mapa', load_fig_mapa(datos_key, var_marca, var_year, var_metrica))   
 
     
     col1, col2= st.columns(2)
     with col1:
-        fig_marca_sku_pie = px.pie(ventas[['articulo','usd']][(ventas['year']==var_year)&(ventas['marca']==var_marca)].groupby(['articulo'], as_index=False).agg('sum'),
-                                  values='usd',
-                                  names='articulo',
-                                  title='Ventas x SKU',
-                                  hole=0.3)
-        st.plotly_chart(fig_marca_sku_pie, theme="streamlit", use_container_width=True)
+        plotly_chart('articulo', load_fig_pie(datos_key, 'articulo', 'Ventas x SKU', marca=var_marca, year=var_year), theme="streamlit", use_container_width=True)
+    with col2:
+        plotly_chart('costos_sku', load_fig_costos_sku(datos_key, var_marca, var_year), theme="streamlit", use_container_width=True)
+
+    var_frecuencia = st.radio('Periodo:', ['Trimestre', 'Mes'], horizontal=True)
+    plotly_chart('tendencia', load_fig_tendencia(datos_key, var_marca, {'Trimestre': 'Q', 'Mes': 'M'}[var_frecuencia]), theme="streamlit", use_container_width=True)
+
+else:
+    # what-if de margenes: el escenario de los controles, la base y los de un
+    # archivo se evaluan juntos en un solo producto matriz (ver escenarios.py)
+    col1, col2= st.columns([1,3])
+    with col1:
+        year_list = list(valores(cubo, 'year'))
+        var_year = st.selectbox('Año:', year_list, index=year_list.index(ultimo_year))
+        st.caption('Choques de costo (%)')
+        var_mp = st.slider('Materia prima (MP)', -50, 50, 0)
+        var_me = st.slider('Material de empaque (ME)', -50, 50, 0)
+        var_vidrio = st.slider('Botellas', -50, 50, 0)
+        var_eur = st.slider('Empaque comprado en EUR', -50, 50, 0)
+        var_precio = st.slider('Precio (%)', -50, 50, 0)
+        var_otros = st.number_input('Otros (USD por unidad)', min_value=0.0, value=float(OTROS), step=0.1)
+        var_merma_mp = st.slider('Merma MP (%)', 0.0, 30.0, MERMA_MP*100, 0.5)
+        var_merma_otros = st.slider('Merma otros (%)', 0.0, 30.0, MERMA_OTROS*100, 0.5)
+        archivo_escenarios = st.file_uploader('Escenarios (CSV o JSON)', type=['csv', 'json'])
+
+    escenario = {'nombre': 'escenario',
+                 'choques': [{'tipo': 'MP', 'pct': var_mp},
+                             {'tipo': 'ME', 'pct': var_me},
+                             {'tipo': 'ME', 'descripcion': '^botella', 'pct': var_vidrio},
+                             {'tipo': 'ME', 'moneda': 'eur', 'pct': var_eur}],
+                 'otros': var_otros,
+                 'merma_mp': var_merma_mp/100,
+                 'merma_otros': var_merma_otros/100,
+                 'precio_pct': var_precio}
+    lote = [escenarios.BASE, escenario]
+    if archivo_escenarios is not None:
+        try:
+            lote = lote + escenarios.read_escenarios(archivo_escenarios)
+        except ValueError as e:
+            st.error('No se pudo leer {}: {}'.format(archivo_escenarios.name, e))
+
+    with perfil.span('escenarios', len(lote)):
+        try:
+            margenes_escenarios, utilidad_escenarios = escenarios.evaluate(load_simulador(datos_key, var_year), lote)
+        except (ValueError, KeyError, TypeError) as e:
+            st.error('Escenario invalido: {}'.format(e))
+            margenes_escenarios, utilidad_escenarios = escenarios.evaluate(load_simulador(datos_key, var_year), lote[:2])
+
     with col2:
-        df_marca_sku_bar = yield_cost_breakdown(var_marca, var_year)
-        fig_marca_sku_bar = px.bar(df_marca_sku_bar, 
-                                   y= 'descripcion',
-                                   x= 'value',
-                                   color='variable',
-                                   title='Costos x SKU')
-        fig_marca_sku_bar.update_layout(xaxis_title="(USD)")
-        fig_marca_sku_bar.update_layout(yaxis_title=None)
-        fig_marca_sku_bar.update_layout(yaxis={'categoryorder':'total ascending'})         
-        st.plotly_chart(fig_marca_sku_bar, theme="streamlit", use_container_width=True)
\ No newline at end of file
+        metrica_utilidad_base = utilidad_escenarios.iloc[0]
+        metrica_utilidad_escenario = utilidad_escenarios.iloc[1]
+        st.metric(label="Utilidad (YTD)" if var_year == ultimo_year else "Utilidad ({})".format(var_year), value='${:,.0f}'.format(metrica_utilidad_escenario),
+                  delta='${:,.0f}'.format(metrica_utilidad_escenario-metrica_utilidad_base))
+        plotly_chart('escenarios', graficos.fig_escenarios(utilidad_escenarios), theme="streamlit", use_container_width=True)
+
+    df_margenes = margenes_escenarios.iloc[:, :2]
+    df_margenes.columns = ['base', 'escenario']
+    df_margenes['diferencia'] = df_margenes['escenario']-df_margenes['base']
+    df_margenes = load_master(datos_key).drop_duplicates(subset=['sku']).merge(df_margenes.round(2).reset_index(), on='sku', how='inner')
+    st.dataframe(df_margenes.dropna(subset=['base', 'escenario'], how='all'), hide_index=True, use_container_width=True)
+
+with st.expander('Memoria de datos'):
+    # con un motor SQL el cubo, las compras y la CxC no estan en memoria
+    st.dataframe(datos.memory_report({x: df for x, df in datos_preparados.items() if isinstance(df, pd.DataFrame)}), hide_index=True)
+
+registros = perfil.finish()
+if registros:
+    with st.expander('Diagnóstico'):
+        st.dataframe(pd.DataFrame(registros), hide_index=True, use_container_width=True)
@@ -0,0 +1,367 @@
+import os
+import json
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+from explosion import explode_bom, bom_long
+from cubo import build_cubo
+from normalizacion import normalize
+import perfil
+import ingesta
+
+# Capa de datos preparados: limpia los libros de Excel una sola vez y guarda el
+# resultado en un snapshot Arrow (feather sin comprimir) que se lee con memory map
+# en los siguientes arranques mientras los archivos fuente no cambien.
+
+PREP_VERSION = 8
+
+SNAPSHOT_DIR = '.snapshot'
+
+FUENTES = ['ventas.xlsx', 'compras.xlsx', 'costo_me.xlsx', 'costo_mp.xlsx', 'costo_me_faltantes.xlsx',
+           'bill_of_materials.xlsx', 'market_share.xlsx', 'cuentas_por_cobrar.xlsx', 'condiciones.xlsx', 'all.csv']
+
+TABLAS = ['ventas', 'compras', 'faltantes', 'componentes', 'bom', 'market_share', 'paises', 'cxc', 'cubo']
+
+# el snapshot se arma y se guarda por grupos independientes: los KPI y graficos
+# de ventas solo necesitan el primero
+GRUPOS = {
+    'ventas': ['ventas', 'market_share', 'paises', 'cubo'],
+    'resto': ['compras', 'faltantes', 'componentes', 'bom', 'cxc'],
+}
+
+LIBROS = {
+    'ventas': ['ventas.xlsx', 'market_share.xlsx'],
+    'resto': ['compras.xlsx', 'costo_me.xlsx', 'costo_mp.xlsx', 'costo_me_faltantes.xlsx',
+              'bill_of_materials.xlsx', 'cuentas_por_cobrar.xlsx', 'condiciones.xlsx'],
+}
+
+# con DASHBOARD_INCREMENTAL=1 ventas y compras se ingieren por bloques y solo
+# se limpian las filas nuevas de cada libro (ver ingesta.py)
+INCREMENTAL = os.environ.get('DASHBOARD_INCREMENTAL', '') not in ('', '0')
+
+FORMATOS_FECHA = ['%d/%m/%Y', '%Y-%d-%m %H:%M:%S']
+
+# columnas de dimension que se guardan como categoricas
+CATEGORIAS = {
+    'ventas': ['pais', 'codigo_cliente', 'cliente', 'marca', 'codigo', 'articulo', 'trimestre'],
+    'cxc': ['codigo_cliente', 'cliente'],
+    'cubo': ['trimestre', 'marca', 'pais', 'cliente', 'articulo', 'codigo'],
+}
+
+## IMPLEMENTAR ALPHAVANTAGE/TIINGO
+
+monedas = pd.DataFrame(
+    {'moneda': ['usd', 'eur', 'rd', 'dkk', 'czk', 'sek', 'jpy', 'cnh', 'chf', 'gbp'],
+     'conversion': [1, 1.05, 0.018, 0.14, 0.043, 0.091, 0.0067, 0.136524, 1.11, 1.21]}
+)
+
+
+def parse_fechas(serie, formatos=FORMATOS_FECHA):
+    # parsea solo los valores unicos, probando cada formato en bloque; lo que no
+    # calza con ningun formato queda como NaT
+    codigos, unicos = pd.factorize(serie.astype(str))
+    unicos = pd.Series(unicos)
+    fechas = pd.Series(pd.NaT, index=unicos.index, dtype='datetime64[ns]')
+    for formato in formatos:
+        faltan = fechas.isna()
+        if not faltan.any():
+            break
+        fechas[faltan] = pd.to_datetime(unicos[faltan], format=formato, errors='coerce')
+    fechas = fechas.dt.normalize().to_numpy()
+    return pd.Series(np.where(codigos >= 0, fechas[codigos], np.datetime64('NaT')), index=serie.index)
+
+
+@perfil.medir()
+def clean_ventas(ventas):
+    ventas = ventas[ventas['articulo'].str.contains('migraci', case=False)== False]
+    ventas = ventas[ventas['codigo'].str.contains("BPT|PT", na=True)]
+    ventas['fecha'] = pd.to_datetime(dict(year=ventas.year, month=ventas.month, day=ventas.day))
+    ventas['trimestre'] =  ventas['fecha'].dt.to_period('Q').dt.strftime('%Y-Q%q')
+    ventas.rename(columns={"familia": "marca",
+                           "monto": "usd"}, inplace=True)
+    for col in ['articulo', 'marca', 'cliente', 'pais']:
+        ventas[col] = normalize(ventas[col])
+    ventas.sort_values(by=['trimestre'], ascending=True, inplace=True)
+    return ventas
+
+
+@perfil.medir()
+def clean_compras(compras):
+    compras = compras.iloc[:, 2:9]
+    compras.columns = ['fecha','proveedor','componente','descripcion','cantidad','moneda', 'costo']
+    compras['fecha'] = parse_fechas(compras['fecha'])
+    compras['moneda'] = compras['moneda'].str.replace(r'[^\w\s]', '', regex=True).str.lower()
+    compras = compras.merge(monedas, left_on=['moneda'], right_on=['moneda'], how='left')
+    compras['costo'] = compras['costo']*compras['conversion']
+    compras.drop(['moneda', 'conversion' , 'descripcion'], axis=1, inplace=True)
+    compras = compras[compras['componente'].str.contains("ME|MP")]
+    compras.sort_values(by=['componente','fecha'], inplace=True)
+    compras['prop'] = compras['cantidad'] / compras.groupby(['componente','fecha'], as_index=False)['cantidad'].transform('sum')
+    compras['costo'] = compras['costo']*compras['prop']
+    compras.drop(['prop','proveedor'], axis=1, inplace=True)
+    compras = compras.groupby(['componente','fecha'], as_index=False).agg('sum')
+    return compras
+
+
+def merge_compras(acumulado, nuevo):
+    # une dos agregados de clean_compras: en las (componente, fecha) repetidas
+    # el costo es el promedio ponderado por cantidad de ambos
+    compras = pd.concat([acumulado, nuevo], ignore_index=True)
+    repetidas = compras.duplicated(['componente', 'fecha'], keep=False)
+    if repetidas.any():
+        unidas = compras[repetidas].assign(monto=compras['costo']*compras['cantidad'])
+        unidas = unidas.groupby(['componente', 'fecha'], as_index=False)[['cantidad', 'monto']].sum()
+        unidas['costo'] = unidas['monto']/unidas['cantidad']
+        compras = pd.concat([compras[~repetidas], unidas.drop(columns=['monto'])], ignore_index=True)
+    return compras.sort_values(by=['componente', 'fecha'], ignore_index=True)
+
+
+@perfil.medir()
+def clean_faltantes(costo_me, costo_mp, costo_me_faltantes, compras):
+    faltantes = pd.concat([costo_me, costo_mp])
+    faltantes = faltantes.iloc[:,[1,10,11]]
+    faltantes.columns=['componente', 'moneda', 'costo']
+    faltantes = faltantes[~faltantes['componente'].isin(compras['componente'])]
+    faltantes.dropna(how='any', inplace=True)
+    faltantes['moneda'] = faltantes['moneda'].str.replace(r'[^\w\s]', '', regex=True).str.lower()
+    faltantes_extras = costo_me_faltantes.rename(columns={"id_item": "componente",
+                                                          "precio": "costo"})
+    faltantes_extras['componente'] = faltantes_extras['componente'].str.upper()
+    faltantes_extras = faltantes_extras[~faltantes_extras['componente'].isin(faltantes['componente'])]
+    faltantes = pd.concat([faltantes, faltantes_extras]).reset_index(drop=True)
+    faltantes = faltantes.merge(monedas, left_on=['moneda'], right_on=['moneda'], how='left')
+    faltantes['costo'] = faltantes['costo']*faltantes['conversion']
+    faltantes.drop(['moneda', 'conversion'], axis=1, inplace=True)
+    return faltantes
+
+
+@perfil.medir()
+def clean_componentes(costo_me, costo_mp, costo_me_faltantes):
+    # descripcion y moneda de la ultima compra de cada componente, para elegir
+    # componentes por nombre o moneda en los escenarios
+    componentes = pd.concat([costo_me, costo_mp])
+    componentes = componentes.iloc[:,[1,2,10]]
+    componentes.columns=['componente', 'descripcion', 'moneda']
+    extras = costo_me_faltantes[['id_item', 'moneda']].rename(columns={"id_item": "componente"})
+    extras['componente'] = extras['componente'].str.upper()
+    componentes = pd.concat([componentes, extras[~extras['componente'].isin(componentes['componente'])]])
+    componentes['descripcion'] = componentes['descripcion'].astype(str).where(componentes['descripcion'].notna())
+    componentes['moneda'] = componentes['moneda'].str.replace(r'[^\w\s]', '', regex=True).str.lower()
+    return componentes.drop_duplicates(subset=['componente']).reset_index(drop=True)
+
+
+@perfil.medir()
+def clean_bom(bom):
+    bom = bom.iloc[:,[1,3,5]]
+    bom.columns = ['componente', 'subcomponente', 'cantidad']
+    bom = bom_long(explode_bom(bom))
+    return bom
+
+
+@perfil.medir()
+def clean_market_share(market_share):
+    market_share['pais'] = market_share['pais'].str.lower()
+    return market_share
+
+
+@perfil.medir()
+def clean_paises(country_codes, market_share):
+    # codigos ISO y market share unidos una sola vez para el mapa
+    country_codes = country_codes[['pais', 'alpha-3']]
+    country_codes['pais'] = country_codes['pais'].str.lower()
+    return country_codes.merge(market_share, left_on=['pais'], right_on=['pais'], how='outer')
+
+
+def clean_condiciones(condiciones):
+    condiciones = condiciones.iloc[:,[1,4]]
+    condiciones.columns = ['codigo_cliente', 'dias_credito']
+    condiciones['dias_credito'] = condiciones['dias_credito'].str.extract('(\d+)').fillna(0)
+    condiciones['dias_credito'] = pd.to_numeric(condiciones['dias_credito'])
+    return condiciones
+
+
+@perfil.medir()
+def clean_cxc(cxc, condiciones):
+    cxc = cxc.iloc[:,1:8]
+    cxc.columns = ['factura','fecha', 'codigo_cliente', 'cliente', 'facturado', 'pagado', 'pendiente']
+    cxc['cliente'] = normalize(cxc['cliente'])
+    cxc['fecha']= parse_fechas(cxc['fecha'])
+    cxc = cxc.merge(clean_condiciones(condiciones), left_on=['codigo_cliente'], right_on=['codigo_cliente'], how='left')
+    return cxc
+
+
+def compact(dd, categorias=()):
+    for col in dd.columns:
+        if col in categorias:
+            dd[col] = dd[col].astype('category')
+        elif pd.api.types.is_integer_dtype(dd[col]):
+            dd[col] = pd.to_numeric(dd[col], downcast='integer')
+        elif pd.api.types.is_float_dtype(dd[col]):
+            # solo si float32 representa exactamente todos los valores
+            corto = dd[col].astype('float32')
+            if ((corto.astype('float64') == dd[col]) | dd[col].isna()).all():
+                dd[col] = corto
+    return dd
+
+
+def memory_report(dd):
+    return pd.DataFrame([{'tabla': x,
+                          'filas': len(df),
+                          'columnas': df.shape[1],
+                          'mb': df.memory_usage(index=True, deep=True).sum()/2**20} for x, df in dd.items()])
+
+
+def read_excel(path, archivo):
+    return pd.read_excel(os.path.join(path, archivo))
+
+
+def cpus():
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+
+
+def pool_libros(libros, procesos=None):
+    # los libros son independientes y se leen a la vez. Por defecto con un hilo
+    # por libro (hasta una por CPU): la descompresion del zip y el parseo del xml
+    # sueltan el GIL lo suficiente para que los libros se solapen, y es lo unico
+    # seguro dentro del servidor de streamlit, que tiene varios hilos (tornado y
+    # las sesiones): un fork ahi puede dejar al hijo trabado en un lock tomado
+    # por otro hilo. Con procesos > 1, como piden los CLI de precalculo.py y
+    # consultas.py antes de crear hilos, se usa un pool de procesos con fork;
+    # con spawn cada proceso volveria a ejecutar el __main__, que bajo streamlit
+    # es el dashboard completo.
+    if procesos and procesos > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(min(procesos, len(libros)) or 1, mp_context=multiprocessing.get_context('fork'))
+    return ThreadPoolExecutor(max(1, min(len(libros), cpus())))
+
+
+def build_datos(path='.', incremental=INCREMENTAL, procesos=None, grupos=None):
+    # grupos: los de GRUPOS que se arman, todos por defecto
+    grupos = grupos or list(GRUPOS)
+    incrementales = ['ventas.xlsx', 'compras.xlsx'] if incremental else []
+    libros = [x for g in grupos for x in LIBROS[g] if x not in incrementales]
+    # los libros grandes primero para repartir mejor la carga
+    libros = sorted(libros, key=lambda x: os.path.getsize(os.path.join(path, x)), reverse=True)
+
+    with perfil.span('read_excel') as registro, pool_libros(libros, procesos) as pool:
+        leidos = {x: pool.submit(read_excel, path, x) for x in libros}
+        if incremental and 'ventas' in grupos:
+            ventas = ingesta.ingest(path, 'ventas.xlsx', clean_ventas, version=PREP_VERSION)
+            ventas = ventas.sort_values(by=['trimestre'], kind='stable')
+        if incremental and 'resto' in grupos:
+            compras = ingesta.ingest(path, 'compras.xlsx', clean_compras, merge_compras, version=PREP_VERSION)
+        leidos = {x: f.result() for x, f in leidos.items()}
+        registro['filas_salida'] = sum(len(x) for x in leidos.values())
+
+    dd = {}
+    if 'ventas' in grupos:
+        if not incremental:
+            ventas = clean_ventas(leidos['ventas.xlsx'])
+        market_share = clean_market_share(leidos['market_share.xlsx'])
+        dd['ventas'] = ventas
+        dd['market_share'] = market_share
+        dd['paises'] = clean_paises(pd.read_csv(os.path.join(path, 'all.csv')), market_share)
+        dd['cubo'] = perfil.medir()(build_cubo)(ventas)
+    if 'resto' in grupos:
+        if not incremental:
+            compras = clean_compras(leidos['compras.xlsx'])
+        costo_me, costo_mp, costo_me_faltantes = leidos['costo_me.xlsx'], leidos['costo_mp.xlsx'], leidos['costo_me_faltantes.xlsx']
+        dd['compras'] = compras
+        dd['faltantes'] = clean_faltantes(costo_me, costo_mp, costo_me_faltantes, compras)
+        dd['componentes'] = clean_componentes(costo_me, costo_mp, costo_me_faltantes)
+        dd['bom'] = clean_bom(leidos['bill_of_materials.xlsx'])
+        dd['cxc'] = clean_cxc(leidos['cuentas_por_cobrar.xlsx'], leidos['condiciones.xlsx'])
+    with perfil.span('compact'):
+        return {x: compact(df.reset_index(drop=True), CATEGORIAS.get(x, ())) for x, df in dd.items()}
+
+
+def source_key(path='.'):
+    # mtime y tamaño de cada fuente, mas la version de la limpieza
+    firma = [PREP_VERSION]
+    for x in FUENTES:
+        st = os.stat(os.path.join(path, x))
+        firma.append([x, st.st_mtime_ns, st.st_size])
+    return hashlib.sha1(json.dumps(firma).encode()).hexdigest()
+
+
+@perfil.medir()
+def read_grupo(key, grupo, path='.', tablas=None):
+    snapshot = os.path.join(path, SNAPSHOT_DIR, grupo)
+    try:
+        with open(os.path.join(snapshot, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('key') != key or sorted(manifest.get('tablas', [])) != sorted(GRUPOS[grupo]):
+        return None
+    try:
+        return {x: feather.read_table(os.path.join(snapshot, x + '.arrow'), memory_map=True).to_pandas()
+                for x in tablas or GRUPOS[grupo]}
+    except (OSError, pa.ArrowInvalid):
+        return None
+
+
+@perfil.medir()
+def write_grupo(key, grupo, dd, path='.'):
+    snapshot = os.path.join(path, SNAPSHOT_DIR, grupo)
+    os.makedirs(snapshot, exist_ok=True)
+    # temporales por proceso: dos procesos que arman el snapshot a la vez no se
+    # pisan los archivos antes del os.replace
+    for x in GRUPOS[grupo]:
+        tmp = os.path.join(snapshot, '{}.arrow.tmp{}'.format(x, os.getpid()))
+        dd[x].reset_index(drop=True).to_feather(tmp, compression='uncompressed')
+        os.replace(tmp, os.path.join(snapshot, x + '.arrow'))
+    tmp = os.path.join(snapshot, 'manifest.json.tmp{}'.format(os.getpid()))
+    with open(tmp, 'w') as f:
+        json.dump({'key': key, 'tablas': GRUPOS[grupo]}, f)
+    os.replace(tmp, os.path.join(snapshot, 'manifest.json'))
+
+
+def grupos_de(tablas):
+    return {g: [x for x in incluidas if x in tablas] for g, incluidas in GRUPOS.items() if set(incluidas) & set(tablas)}
+
+
+def read_snapshot(key, path='.', tablas=None):
+    tablas = list(tablas or TABLAS)
+    dd = {}
+    for grupo, pedidas in grupos_de(tablas).items():
+        leidas = read_grupo(key, grupo, path, pedidas)
+        if leidas is None:
+            return None
+        dd.update(leidas)
+    return {x: dd[x] for x in tablas}
+
+
+def write_snapshot(key, dd, path='.'):
+    # cada grupo completo que venga en dd
+    for grupo, incluidas in GRUPOS.items():
+        if all(x in dd for x in incluidas):
+            write_grupo(key, grupo, dd, path)
+
+
+def load_datos(path='.', key=None, incremental=INCREMENTAL, tablas=None, procesos=None):
+    # con tablas solo se leen esas del snapshot, y si falta el snapshot solo se
+    # arman sus grupos: el dashboard muestra los KPI de ventas sin esperar a
+    # compras, lista de materiales y CxC
+    key = key or source_key(path)
+    tablas = list(tablas or TABLAS)
+    dd = {}
+    faltan = {}
+    for grupo, pedidas in grupos_de(tablas).items():
+        leidas = read_grupo(key, grupo, path, pedidas)
+        if leidas is None:
+            faltan[grupo] = pedidas
+        else:
+            dd.update(leidas)
+    if faltan:
+        construidas = build_datos(path, incremental, procesos, list(faltan))
+        try:
+            write_snapshot(key, construidas, path)
+        except OSError:
+            pass
+        for grupo, pedidas in faltan.items():
+            dd.update(read_grupo(key, grupo, path, pedidas) or {x: construidas[x] for x in pedidas})
+    return {x: dd[x] for x in tablas}
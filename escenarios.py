@@ -0,0 +1,194 @@
+import re
+import json
+import os
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from costos import OTROS
+from explosion import MERMA_MP, MERMA_OTROS
+from margenes import precios_year
+from cubo import rollup, total
+
+# Simulador what-if de margenes. La lista de materiales explotada queda como
+# matriz dispersa (SKU x componente) y el costo de cada componente como vector;
+# un escenario solo cambia ese vector (choques de costo y merma), el precio y
+# los otros costos por unidad. Un lote de escenarios es una matriz
+# (componente x escenario) y todos los margenes por SKU salen de un solo
+# producto matriz dispersa x matriz densa.
+#
+# Un escenario es un dict:
+#   {'nombre': 'vidrio +12%',
+#    'choques': [{'descripcion': '^botella', 'pct': 12},
+#                {'tipo': 'ME', 'moneda': 'eur', 'pct': 8}],
+#    'otros': 3.67, 'merma_mp': 0.05, 'merma_otros': 0.03, 'precio_pct': 0}
+# Cada choque aplica `pct` a los componentes que cumplen todos sus filtros:
+# tipo (ME/MP), moneda de la ultima compra, descripcion y componente (regex).
+
+FILTROS = ['tipo', 'moneda', 'descripcion', 'componente']
+
+PARAMETROS = ['otros', 'merma_mp', 'merma_otros', 'precio_pct']
+
+BASE = {'nombre': 'base', 'choques': [], 'otros': OTROS, 'merma_mp': MERMA_MP, 'merma_otros': MERMA_OTROS, 'precio_pct': 0.0}
+
+Simulador = namedtuple('Simulador', ['skus', 'matriz', 'presencia', 'componentes', 'costo', 'es_me', 'es_mp',
+                                     'filas', 'precio', 'cantidad', 'ajuste'])
+
+
+def build_simulador(ventas, cubo, master, explosion, tabla, componentes, year):
+    # solo los SKU de master, como costo_sku; un SKU con varias filas en master
+    # suma su costo una vez por fila
+    filas = master['sku'].value_counts()
+    skus = explosion.skus[explosion.skus.isin(filas.index)]
+    matriz = explosion.matriz[explosion.skus.get_indexer(skus)]
+
+    es_me = np.asarray(explosion.componentes.str.contains("ME"))
+    es_mp = np.asarray(explosion.componentes.str.contains("MP"))
+    tipos = np.column_stack([~es_me, es_me]).astype(float)
+
+    componentes = componentes.drop_duplicates(subset=['componente']).set_index('componente')
+    componentes = componentes.reindex(explosion.componentes)[['descripcion', 'moneda']]
+    componentes['tipo'] = np.where(es_me, 'ME', np.where(es_mp, 'MP', ''))
+    componentes['componente'] = explosion.componentes
+
+    precios = precios_year(ventas, year, 'codigo').set_index('codigo')['precio']
+    cantidad = rollup(cubo, ['codigo'], ['cantidad'], year=year).set_index('codigo')['cantidad']
+    return Simulador(skus,
+                     matriz,
+                     ((matriz != 0) @ tipos) > 0,
+                     componentes.reset_index(drop=True),
+                     tabla.loc[year].reindex(explosion.componentes).fillna(0).to_numpy(dtype=float),
+                     es_me,
+                     es_mp,
+                     filas.reindex(skus).to_numpy(dtype=float),
+                     precios.reindex(skus).to_numpy(dtype=float),
+                     cantidad.reindex(skus).fillna(0).to_numpy(dtype=float),
+                     float(total(cubo, 'usd_negativo', year=year)))
+
+
+def numero(valor, campo, nombre):
+    # campos numericos de un archivo subido: "5%" o una lista salen como ValueError
+    try:
+        valor = float(valor)
+    except (TypeError, ValueError):
+        raise ValueError('{} debe ser numérico en {}: {!r}'.format(campo, nombre, valor)) from None
+    if not np.isfinite(valor):
+        raise ValueError('{} debe ser numérico en {}: {!r}'.format(campo, nombre, valor))
+    return valor
+
+
+def check_escenario(escenario):
+    # completa con los valores base y valida los choques; todo error de un
+    # archivo subido sale como ValueError
+    if not isinstance(escenario, dict):
+        raise ValueError('cada escenario debe ser un objeto, no {!r}'.format(escenario))
+    escenario = dict(BASE, **{x: v for x, v in escenario.items() if v is not None})
+    if not isinstance(escenario['choques'], list):
+        raise ValueError('choques debe ser una lista en {}'.format(escenario['nombre']))
+    choques = []
+    for choque in escenario['choques']:
+        if not isinstance(choque, dict):
+            raise ValueError('cada choque debe ser un objeto en {}: {!r}'.format(escenario['nombre'], choque))
+        desconocidos = set(choque) - set(FILTROS) - {'pct'}
+        if desconocidos:
+            raise ValueError('filtro desconocido en {}: {}'.format(escenario['nombre'], ', '.join(sorted(desconocidos))))
+        if choque.get('pct') is None:
+            raise ValueError('falta pct en {}: {!r}'.format(escenario['nombre'], choque))
+        choques.append(dict(choque, pct=numero(choque['pct'], 'pct', escenario['nombre'])))
+        for x in ['descripcion', 'componente']:
+            if choque.get(x) is not None and choque.get(x) != '':
+                try:
+                    re.compile(str(choque[x]))
+                except re.error as e:
+                    raise ValueError('expresion invalida en {} ({}): {}'.format(escenario['nombre'], x, e))
+    escenario['choques'] = choques
+    for x in PARAMETROS:
+        escenario[x] = numero(escenario[x], x, escenario['nombre'])
+    for x in ['merma_mp', 'merma_otros']:
+        if not 0 <= escenario[x] < 1:
+            raise ValueError('{} fuera de [0, 1) en {}'.format(x, escenario['nombre']))
+    return escenario
+
+
+def mask_choque(componentes, choque):
+    mask = np.ones(len(componentes), dtype=bool)
+    for x in FILTROS:
+        valor = choque.get(x)
+        if valor is None or valor == '':
+            continue
+        columna = componentes[x].fillna('')
+        if x in ('descripcion', 'componente'):
+            mask &= np.asarray(columna.str.contains(str(valor), case=False, regex=True))
+        else:
+            mask &= np.asarray(columna.str.lower() == str(valor).lower())
+    return mask
+
+
+def factores(simulador, escenarios):
+    # (componente x escenario): choques de costo por la razon de merma; la merma
+    # base ya esta en la matriz, una merma nueva m la escala por (1-base)/(1-m)
+    merma_base = np.where(simulador.es_mp, MERMA_MP, MERMA_OTROS)
+    factor = np.ones((len(simulador.costo), len(escenarios)))
+    masks = {}
+    for k, escenario in enumerate(escenarios):
+        for choque in escenario['choques']:
+            # en un lote los mismos filtros se repiten con otro pct
+            filtro = tuple(str(choque.get(x) or '') for x in FILTROS)
+            if filtro not in masks:
+                masks[filtro] = mask_choque(simulador.componentes, choque)
+            factor[masks[filtro], k] *= 1+float(choque['pct'])/100
+        merma = np.where(simulador.es_mp, escenario['merma_mp'], escenario['merma_otros'])
+        factor[:, k] *= (1-merma_base)/(1-merma)
+    return factor
+
+
+def evaluate(simulador, escenarios):
+    # margen por SKU (SKU x escenario) y utilidad del año por escenario, como el
+    # KPI del resumen: cantidad x margen mas el A&P; SKU sin margen suman cero
+    escenarios = [check_escenario(x) for x in escenarios]
+    nombres = pd.Index([x['nombre'] for x in escenarios], name='escenario')
+    if not len(escenarios):
+        return pd.DataFrame(index=simulador.skus, columns=nombres, dtype=float), pd.Series(index=nombres, dtype=float)
+
+    costo = simulador.costo[:, None]*factores(simulador, escenarios)
+    n = len(escenarios)
+    costos = simulador.matriz @ np.hstack([costo*~simulador.es_me[:, None], costo*simulador.es_me[:, None]])
+    liquido = np.where(simulador.presencia[:, [0]], costos[:, :n], np.nan)
+    material_empaque = np.where(simulador.presencia[:, [1]], costos[:, n:], np.nan)
+
+    precio = simulador.precio[:, None]*(1+np.array([x['precio_pct'] for x in escenarios], dtype=float)/100)
+    otros = np.array([x['otros'] for x in escenarios], dtype=float)
+    margen = precio - simulador.filas[:, None]*(liquido+material_empaque) - otros
+    utilidad = np.nansum(simulador.cantidad[:, None]*margen, axis=0) + simulador.ajuste
+    return (pd.DataFrame(margen, index=pd.Index(simulador.skus, name='sku'), columns=nombres),
+            pd.Series(utilidad, index=nombres, name='utilidad'))
+
+
+def read_escenarios(archivo, nombre=None):
+    # JSON: lista de escenarios (o uno solo). CSV: una fila por choque con las
+    # columnas escenario, pct y los filtros; otros, merma_mp, merma_otros y
+    # precio_pct se toman de la primera fila del escenario que los tenga
+    nombre = nombre or getattr(archivo, 'name', archivo)
+    if os.path.splitext(str(nombre))[1].lower() == '.json':
+        if hasattr(archivo, 'read'):
+            escenarios = json.load(archivo)
+        else:
+            with open(archivo) as f:
+                escenarios = json.load(f)
+        return escenarios if isinstance(escenarios, list) else [escenarios]
+
+    dd = pd.read_csv(archivo)
+    if 'escenario' not in dd:
+        raise ValueError('falta la columna escenario en ' + str(nombre))
+    dd = dd.astype(object).where(dd.notna(), None)
+    escenarios = []
+    for escenario, df in dd.groupby('escenario', sort=False):
+        x = {'nombre': str(escenario), 'choques': []}
+        for p in PARAMETROS:
+            valores = [v for v in df.get(p, []) if v is not None]
+            if valores:
+                x[p] = float(valores[0])
+        if 'pct' in df:
+            for fila in df[df['pct'].notna()].to_dict('records'):
+                x['choques'].append(dict({f: fila[f] for f in FILTROS if fila.get(f) is not None}, pct=float(fila['pct'])))
+        escenarios.append(x)
+    return escenarios
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+# Explosion de la lista de materiales a cualquier profundidad. El grafo
+# padre -> hijo se guarda como matriz dispersa y el requerimiento de cada SKU
+# se obtiene con productos sucesivos hasta llegar a las hojas.
+
+MERMA_MP = 0.05
+MERMA_OTROS = 0.03
+
+Explosion = namedtuple('Explosion', ['matriz', 'skus', 'componentes'])
+
+
+def adjacency(dd):
+    dd = dd.dropna(how='any')
+    codigos, nodos = pd.factorize(pd.concat([dd['componente'], dd['subcomponente']], ignore_index=True))
+    nodos = pd.Index(nodos)
+    padres, hijos = codigos[:len(dd)], codigos[len(dd):]
+    cantidad = dd['cantidad'].to_numpy(dtype=float)
+
+    # las MP compuestas son mezclas: sus hijos se reparten en proporcion
+    es_mp = np.asarray(nodos.str.contains('MP'))
+    suma = np.bincount(padres, weights=cantidad, minlength=len(nodos))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cantidad = np.where(es_mp[padres], cantidad/suma[padres], cantidad)
+
+    q = sparse.csr_matrix((cantidad, (padres, hijos)), shape=(len(nodos), len(nodos)))
+    return q, nodos
+
+
+def check_ciclos(q, nodos):
+    n, etiquetas = connected_components(q, directed=True, connection='strong')
+    miembros = np.bincount(etiquetas, minlength=n)
+    en_ciclo = (miembros[etiquetas] > 1) | (q.diagonal() != 0)
+    if en_ciclo.any():
+        raise ValueError('ciclo en la lista de materiales: ' + ', '.join(nodos[en_ciclo]))
+
+
+def explode_bom(dd, merma_mp=MERMA_MP, merma_otros=MERMA_OTROS, merma_nivel=()):
+    # merma_nivel[k] es la merma del nivel k+1 (hijos directos del SKU = nivel 1)
+    # y se acumula hacia los niveles inferiores
+    q, nodos = adjacency(dd)
+    check_ciclos(q, nodos)
+
+    hijos = q.getnnz(axis=1)
+    hojas = hijos == 0
+    es_sku = ~np.asarray(nodos.str.contains('MP|ME|MV')) & ~hojas
+    solo_hojas = sparse.diags(hojas.astype(float))
+    solo_intermedios = sparse.diags((~hojas).astype(float))
+
+    nivel = q[es_sku]
+    total = sparse.csr_matrix(nivel.shape)
+    for k in range(len(nodos)):
+        if nivel.nnz == 0:
+            break
+        if k < len(merma_nivel):
+            nivel = nivel/(1-merma_nivel[k])
+        total = total + nivel @ solo_hojas
+        nivel = nivel @ solo_intermedios @ q
+
+    componentes = nodos[hojas]
+    merma = np.where(componentes.str.contains('MP'), merma_mp, merma_otros)
+    matriz = (total.tocsc()[:, np.flatnonzero(hojas)] @ sparse.diags(1/(1-merma))).tocsr()
+    matriz.sort_indices()
+    return Explosion(matriz, nodos[es_sku], componentes)
+
+
+def bom_long(explosion):
+    coo = explosion.matriz.tocoo()
+    return pd.DataFrame({'sku': explosion.skus[coo.row],
+                         'componente': explosion.componentes[coo.col],
+                         'cantidad': coo.data})
+
+
+def matriz_bom(bom):
+    filas, skus = pd.factorize(bom['sku'])
+    columnas, componentes = pd.factorize(bom['componente'])
+    matriz = sparse.csr_matrix((bom['cantidad'].to_numpy(dtype=float), (filas, columnas)),
+                               shape=(len(skus), len(componentes)))
+    return Explosion(matriz, pd.Index(skus), pd.Index(componentes))
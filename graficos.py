@@ -0,0 +1,129 @@
+import plotly.express as px
+from cubo import rollup
+
+# Constructores de figuras. No dependen de streamlit: el dashboard los envuelve
+# en caches por (grafico, marca, año, metrica).
+
+
+def fig_resumen(cubo):
+    df_resumen = rollup(cubo, ['year'], ['usd_positivo', 'usd_negativo']).rename(columns={'usd_positivo':'ingreso',
+                                                                                          'usd_negativo':'a&p'})
+    df_resumen = df_resumen.melt(id_vars=['year'], var_name='clase', value_name='usd')
+    df_resumen = df_resumen[df_resumen['usd']!=0].sort_values(by=['year','clase']).reset_index(drop=True)
+    df_resumen['usd'] = df_resumen['usd'].abs()
+    df_resumen['porcentaje'] = (df_resumen['usd'] / df_resumen.groupby('year')['usd'].transform('sum')) * 100
+    fig = px.bar(df_resumen,
+                 y='usd',
+                 x='year',
+                 text=[f"{value:.1f}%" for value in df_resumen['porcentaje']],
+                 color='clase',
+                 height=550)
+    fig.update_layout(yaxis_title="(USD)")
+    fig.update_layout(xaxis_title=None)
+    fig.update_xaxes(type='category')
+    return fig
+
+
+def fig_pie(cubo, dimension, title, **filtros):
+    fig = px.pie(rollup(cubo, [dimension], ['usd'], **filtros),
+                 values='usd',
+                 names=dimension,
+                 title=title,
+                 hole=0.3)
+    return fig
+
+
+def fig_cxc_vigencia(df_aging):
+    fig = px.bar(df_aging,
+                 x = 'usd',
+                 y='vigencia',
+                 title='Cuentas x cobrar x vigencia',
+                 height=550
+                 )
+    fig.update_layout(xaxis_title="(USD)")
+    fig.update_layout(yaxis_title="(dias vencidos)")
+    return fig
+
+
+def fig_cxc_top(df_top_clientes):
+    fig = px.bar(df_top_clientes,
+                 x='usd',
+                 y='cliente',
+                 color='vigencia',
+                 title='Cuentas x cobrar x cliente',
+                 height=550)
+    fig.update_layout(xaxis_title="(USD)")
+    fig.update_layout(yaxis_title=None)
+    fig.update_layout(yaxis={'categoryorder':'total ascending'})
+    return fig
+
+
+def fig_cxc_tendencia(df_vencido):
+    fig = px.line(df_vencido,
+                  x='fecha',
+                  y='vencido',
+                  markers=True,
+                  title='Cuentas x cobrar vencidas x cierre de mes')
+    fig.update_layout(yaxis_title="(USD)")
+    fig.update_layout(xaxis_title=None)
+    return fig
+
+
+def mapa_marca(cubo, paises, marca, year):
+    df_marca_mapa = rollup(cubo, ['marca', 'pais'], ['usd_positivo', 'cantidad'], marca=marca, year=year).rename(columns={'usd_positivo':'ventas'})
+    df_marca_mapa = df_marca_mapa.merge(paises, left_on=['pais'], right_on=['pais'], how='left')
+    df_marca_mapa['market_share'] = ((df_marca_mapa['cantidad']*4.2*0.4)/((df_marca_mapa['aa_per_capita']*df_marca_mapa['population'])*0.03))*100
+    df_marca_mapa['market_share'] = df_marca_mapa['market_share'].round(3)
+    return df_marca_mapa
+
+
+def fig_mapa(df_marca_mapa, metrica):
+    fig = px.choropleth(df_marca_mapa, locations="alpha-3", color=metrica,
+                        color_continuous_scale=px.colors.sequential.PuBu,
+                        hover_name="pais",
+                        width=1010)
+
+    fig.update_geos(projection_type="natural earth")
+    fig.update_geos(lataxis_showgrid=True, lonaxis_showgrid=True)
+    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+    fig.update_layout(mapbox_style="carto-positron", mapbox_zoom=2, mapbox_center={"lat": 51, "lon": 10})
+    fig.update_layout(title_text="European Sales Choropleth Map", geo=dict(showcoastlines=True))
+    return fig
+
+
+def fig_costos_sku(df_marca_sku_bar):
+    fig = px.bar(df_marca_sku_bar,
+                 y= 'descripcion',
+                 x= 'value',
+                 color='variable',
+                 title='Costos x SKU')
+    fig.update_layout(xaxis_title="(USD)")
+    fig.update_layout(yaxis_title=None)
+    fig.update_layout(yaxis={'categoryorder':'total ascending'})
+    return fig
+
+
+def fig_margen_tendencia(df_tendencia):
+    fig = px.line(df_tendencia,
+                  x='periodo',
+                  y='margen',
+                  color='descripcion',
+                  markers=True,
+                  title='Margen x SKU')
+    fig.update_layout(yaxis_title="(USD)")
+    fig.update_layout(xaxis_title=None)
+    fig.update_xaxes(type='category')
+    return fig
+
+
+def fig_escenarios(utilidad):
+    df_escenarios = utilidad.rename('usd').reset_index()
+    fig = px.bar(df_escenarios,
+                 x='escenario',
+                 y='usd',
+                 text=[f"${value:,.0f}" for value in df_escenarios['usd']],
+                 title='Utilidad x escenario')
+    fig.update_layout(yaxis_title="(USD)")
+    fig.update_layout(xaxis_title=None)
+    fig.update_xaxes(type='category')
+    return fig
@@ -0,0 +1,178 @@
+import os
+import json
+import hashlib
+import pandas as pd
+import pyarrow.feather as feather
+from pandas.io.parsers import TextParser
+import perfil
+
+# Ingesta incremental de los libros que solo crecen (ventas, compras). Cada
+# libro se lee en streaming con openpyxl en bloques de filas, cada bloque pasa
+# por la limpieza de siempre y el resultado se agrega a un almacen local en
+# INGESTA_DIR. Por fuente se guarda una marca de agua: filas ya procesadas,
+# huella de la ultima fila y ultima fecha. Las siguientes corridas solo limpian
+# las filas nuevas; si el libro se reescribio (la huella no calza) la fuente se
+# vuelve a ingerir desde cero.
+#
+# Los bloques se convierten igual que read_excel (misma conversion de celdas y
+# TextParser), asi la limpieza ve los mismos tipos que con el libro completo.
+
+INGESTA_DIR = '.ingesta'
+
+FILAS_BLOQUE = 50_000
+
+
+class FuenteReescrita(ValueError):
+    pass
+
+
+def convert_celda(x):
+    # como pandas: vacio -> '', numeros enteros -> int
+    if x is None:
+        return ''
+    if isinstance(x, float) and x.is_integer():
+        return int(x)
+    return x
+
+
+def huella(fila):
+    return hashlib.sha1(json.dumps([str(x) for x in fila]).encode()).hexdigest()
+
+
+def parse_bloque(encabezado, filas, ancho):
+    ancho = max([ancho] + [len(x) for x in filas])
+    data = [x + ['']*(ancho-len(x)) for x in [encabezado] + filas]
+    return TextParser(data, header=0, skip_blank_lines=False).read(), ancho
+
+
+def read_bloques(archivo, marca, filas=FILAS_BLOQUE):
+    # marca = {'filas': n, 'huella': h} de la corrida anterior; se actualiza en
+    # sitio a medida que se entregan bloques
+    # openpyxl solo hace falta en la ingesta incremental
+    from openpyxl import load_workbook
+    libro = load_workbook(archivo, read_only=True, data_only=True, keep_links=False)
+    try:
+        hoja = libro.active
+        hoja.reset_dimensions()
+        lector = hoja.iter_rows(values_only=True)
+        encabezado = [convert_celda(x) for x in next(lector, ())]
+        while encabezado and encabezado[-1] == '':
+            encabezado.pop()
+        ancho = len(encabezado)
+
+        leidas, bloque, vacias = 0, [], []
+        for fila in lector:
+            fila = [convert_celda(x) for x in fila]
+            while fila and fila[-1] == '':
+                fila.pop()
+            if not fila:
+                # las filas vacias al final del libro no cuentan
+                vacias.append(fila)
+                continue
+            for x in vacias + [fila]:
+                leidas += 1
+                if leidas < marca['filas']:
+                    continue
+                if leidas == marca['filas']:
+                    if huella(x) != marca['huella']:
+                        raise FuenteReescrita(archivo)
+                    continue
+                bloque.append(x)
+            vacias = []
+            if len(bloque) >= filas:
+                dd, ancho = parse_bloque(encabezado, bloque, ancho)
+                marca['filas'], marca['huella'] = leidas, huella(bloque[-1])
+                bloque = []
+                yield dd
+
+        if leidas < marca['filas']:
+            raise FuenteReescrita(archivo)
+        if bloque:
+            dd, ancho = parse_bloque(encabezado, bloque, ancho)
+            marca['filas'], marca['huella'] = leidas, huella(bloque[-1])
+            yield dd
+    finally:
+        libro.close()
+
+
+def read_estado(store, nombre):
+    try:
+        with open(os.path.join(store, nombre + '.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_estado(store, nombre, estado):
+    tmp = os.path.join(store, nombre + '.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(estado, f)
+    os.replace(tmp, os.path.join(store, nombre + '.json'))
+
+
+def read_partes(store, partes):
+    return pd.concat([feather.read_table(os.path.join(store, x), memory_map=True).to_pandas() for x in partes],
+                     ignore_index=True)
+
+
+def write_parte(store, parte, dd):
+    tmp = os.path.join(store, parte + '.tmp')
+    dd.reset_index(drop=True).to_feather(tmp, compression='uncompressed')
+    os.replace(tmp, os.path.join(store, parte))
+
+
+def ingest(path, archivo, clean, merge=None, version=None, filas=FILAS_BLOQUE):
+    # sin merge cada bloque limpio se guarda como una parte nueva; con merge el
+    # almacen guarda un solo agregado y merge(acumulado, nuevo) lo actualiza
+    store = os.path.join(path, INGESTA_DIR)
+    os.makedirs(store, exist_ok=True)
+    nombre = os.path.splitext(archivo)[0]
+
+    previo = read_estado(store, nombre)
+    if previo.get('version') != version:
+        previo = {}
+    estado = {'version': version,
+              'filas': previo.get('filas', 0),
+              'huella': previo.get('huella'),
+              'fecha': previo.get('fecha'),
+              'partes': list(previo.get('partes', []))}
+
+    with perfil.span('ingest:' + archivo) as registro:
+        acumulado = read_partes(store, estado['partes']) if merge and estado['partes'] else None
+        nuevas = 0
+        try:
+            for bloque in read_bloques(os.path.join(path, archivo), estado, filas):
+                nuevas += len(bloque)
+                limpio = clean(bloque)
+                if 'fecha' in limpio and limpio['fecha'].notna().any():
+                    fecha = str(limpio['fecha'].max().date())
+                    estado['fecha'] = max(estado['fecha'] or fecha, fecha)
+                if merge:
+                    acumulado = limpio if acumulado is None else merge(acumulado, limpio)
+                else:
+                    # el nombre de la parte es la marca de agua en que termina:
+                    # si la corrida se corta, la siguiente la sobreescribe
+                    parte = '{}-{:012d}.arrow'.format(nombre, estado['filas'])
+                    write_parte(store, parte, limpio)
+                    estado['partes'].append(parte)
+        except FuenteReescrita:
+            write_estado(store, nombre, {})
+            return ingest(path, archivo, clean, merge, version, filas)
+
+        if merge and nuevas:
+            parte = '{}-{:012d}.arrow'.format(nombre, estado['filas'])
+            write_parte(store, parte, acumulado)
+            estado['partes'] = [parte]
+        registro['filas_entrada'] = nuevas
+
+        # el estado es el punto de confirmacion: lo que no figura en el no se lee
+        write_estado(store, nombre, estado)
+        for x in os.listdir(store):
+            if x.startswith(nombre + '-') and x not in estado['partes']:
+                os.remove(os.path.join(store, x))
+
+        if not estado['partes']:
+            return clean(pd.read_excel(os.path.join(path, archivo)))
+        dd = acumulado if merge and acumulado is not None else read_partes(store, estado['partes'])
+        registro['filas_salida'] = len(dd)
+        return dd
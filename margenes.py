@@ -0,0 +1,114 @@
+import pandas as pd
+from costos import costos_year, costo_sku, costo_periodos, tabla_periodos
+import consultas
+
+# Margen unitario por SKU: precio promedio del año menos el costo explotado de
+# la lista de materiales. Sin dependencia de streamlit, para poder usarse
+# fuera del dashboard.
+#
+# Las ventas y las compras pueden ser DataFrame o tablas de consultas.py; en el
+# segundo caso precios, maestro de SKU y costos por periodo se resuelven en SQL.
+
+
+def master_sku(ventas, bom):
+    if isinstance(ventas, consultas.Tabla):
+        master = consultas.distintos(ventas, ['codigo', 'marca', 'articulo'])
+    else:
+        master = ventas[['codigo', 'marca', 'articulo']].drop_duplicates().dropna(how='any')
+    master = master.rename(columns={'codigo':'sku', 'articulo':'descripcion'})
+    master = master[master['sku'].isin(bom['sku'])]
+    return master
+
+
+def precios(ventas, by):
+    # precio promedio ponderado por cantidad para cada combinacion de `by`
+    # assign devuelve un frame nuevo: no depende de mode.copy_on_write
+    precios = ventas[ventas['usd']>=0]
+    precios = precios.assign(prop=precios['cantidad']/precios.groupby(by, as_index=False, observed=True)['cantidad'].transform('sum'))
+    precios = precios.assign(precio=(precios['usd']/precios['cantidad'])*precios['prop'])
+    precios = precios[by + ['precio']].dropna(how='any')
+    precios = precios.groupby(by, as_index=False, observed=True).agg('sum')
+    return precios
+
+
+def precios_sumas(sumas, by):
+    # precio ponderado desde consultas.sumas_precio, reagrupado por `by`
+    sumas = sumas.groupby(by, as_index=False, observed=True)[['usd', 'cantidad']].sum(min_count=1)
+    sumas['precio'] = sumas['usd']/sumas['cantidad'].where(sumas['cantidad'] != 0)
+    return sumas[by + ['precio']].dropna(how='any')
+
+
+def precios_year(ventas, year, by):
+    if isinstance(ventas, consultas.Tabla):
+        return precios_sumas(consultas.sumas_precio(ventas, [by], year=year), [by])
+    return precios(ventas[ventas['year']==year], [by])
+
+
+def utilidad(ventas, master, explosion, tabla, year):
+    if master.shape[0]==0:
+        return pd.DataFrame(columns=['sku','variable', 'value'])
+
+    costos = costos_year(tabla, year)
+    precios = precios_year(ventas, year, 'codigo').rename(columns={'codigo':'sku'})
+
+    master = costo_sku(explosion, costos, master, 'sku')
+    master = master.merge(precios, left_on=['sku'], right_on=['sku'], how='left')
+    master['margen'] = master['precio']-master['material_empaque']-master['liquido']-master['otros']
+    master = master[['sku','margen']].dropna(how='any')
+    return master
+
+
+def cost_breakdown(ventas, master, explosion, tabla, marca, year):
+    master = master[master['marca']==marca]
+
+    if master.shape[0]==0:
+        return pd.DataFrame(columns=['descripcion','variable', 'value'])
+
+    costos = costos_year(tabla, year)
+    precios = precios_year(ventas, year, 'articulo').rename(columns={'articulo':'descripcion'})
+
+    master = costo_sku(explosion, costos, master, 'descripcion')
+    master = master.merge(precios, left_on=['descripcion'], right_on=['descripcion'], how='left')
+    master['margen'] = master['precio']-master['material_empaque']-master['liquido']-master['otros']
+    master.drop(['precio'], axis=1, inplace=True)
+    master.dropna(how='any', inplace=True)
+    master = master.melt(id_vars=['descripcion'])
+    master['value'] = master['value'].round(2)
+    return master
+
+
+def margen_tendencia(ventas, master, explosion, historial, faltantes, marca, frecuencia='Q'):
+    # margen unitario por SKU de la marca en cada mes ('M') o trimestre ('Q'):
+    # precio del periodo menos el costo a la fecha de cierre del periodo
+    master = master[master['marca']==marca]
+    if isinstance(ventas, consultas.Tabla):
+        # por mes en SQL y luego por periodo: numerador y denominador se suman
+        sumas = consultas.sumas_precio(ventas, ['articulo', 'year', 'month'], marca=marca)
+        sumas['periodo'] = pd.to_datetime(sumas[['year', 'month']].assign(day=1)).dt.to_period(frecuencia)
+        precios_periodo = precios_sumas(sumas, ['articulo', 'periodo'])
+    else:
+        ventas = ventas[ventas['marca']==marca]
+        ventas = ventas.assign(periodo=ventas['fecha'].dt.to_period(frecuencia))
+        precios_periodo = precios(ventas, ['articulo', 'periodo'])
+
+    if master.shape[0]==0 or precios_periodo.shape[0]==0:
+        return pd.DataFrame(columns=['descripcion', 'periodo', 'margen'])
+
+    precios_periodo = precios_periodo.rename(columns={'articulo':'descripcion'})
+    periodos = pd.PeriodIndex(precios_periodo['periodo'].unique()).sort_values()
+
+    # con un motor SQL el historial es la tabla de compras
+    if isinstance(historial, consultas.Tabla):
+        tabla = consultas.tabla_periodos(historial, faltantes, periodos.end_time.normalize())
+    else:
+        tabla = tabla_periodos(historial, faltantes, periodos.end_time.normalize())
+    tabla.index = periodos
+
+    master = costo_periodos(explosion, tabla, master, 'descripcion').rename(columns={'fecha':'periodo'})
+    master = master.merge(precios_periodo, left_on=['descripcion', 'periodo'], right_on=['descripcion', 'periodo'], how='inner')
+    master['margen'] = master['precio']-master['material_empaque']-master['liquido']-master['otros']
+    master = master[['descripcion', 'periodo', 'margen']].dropna(how='any')
+    master['descripcion'] = master['descripcion'].astype(str)
+    master['periodo'] = master['periodo'].astype(str)
+    master['margen'] = master['margen'].round(2)
+    return master.sort_values(by=['periodo', 'descripcion'], ignore_index=True)
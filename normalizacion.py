@@ -0,0 +1,91 @@
+import re
+import unicodedata
+import numpy as np
+import pandas as pd
+
+# Tabla de reglas de limpieza de texto por columna. Cada columna compila sus
+# reglas en una sola funcion que se aplica una vez por valor distinto; el
+# resultado vuelve a las filas a traves de los codigos categoricos.
+#
+#   ('minusculas', None, None)      pasa a minusculas
+#   ('ascii', None, None)           quita acentos (NFKD -> ascii)
+#   ('igual', valor, nuevo)         reemplaza el valor exacto
+#   ('contiene', patron, nuevo)     reemplaza todo el valor si el patron aparece
+#   ('reemplazar', patron, nuevo)   re.sub del patron dentro del valor
+
+REGLAS = {
+    'articulo': [
+        ('minusculas', None, None),
+        ('reemplazar', 's.s.', ''),
+        ('reemplazar', 'ron', ''),
+        ('reemplazar', 'licor', ''),
+        ('reemplazar', '[().,-]', ''),
+        ('reemplazar', 'eumac', 'eu'),
+        ('reemplazar', 'eumo', 'eu'),
+        ('reemplazar', 'uemac', 'eu'),
+        ('reemplazar', 'spirit drink', ''),
+        ('reemplazar', 'spirt drink', ''),
+        ('reemplazar', 'ml', ''),
+        ('reemplazar', '6/700', ''),
+        ('reemplazar', r'\s+', ' '),
+    ],
+    'marca': [
+        ('minusculas', None, None),
+        ('igual', 'bavaro premiun', 'bavaro'),
+        ('contiene', 'quorhum', 'quorhum'),
+        ('contiene', 'cubaney', 'cubaney'),
+        ('contiene', 'presidencial', 'presidente'),
+    ],
+    'cliente': [
+        ('minusculas', None, None),
+        ('contiene', 'compagnia', 'compagnia dei caraibi'),
+        ('contiene', 'dufry', 'dufry'),
+    ],
+    'pais': [
+        ('contiene', 'Russian', 'Russia'),
+        ('contiene', 'USA', 'United States of America'),
+        ('contiene', 'Schweiz', 'Switzerland'),
+        ('minusculas', None, None),
+        ('ascii', None, None),
+    ],
+}
+
+
+def to_ascii(x):
+    return unicodedata.normalize('NFKD', x).encode('ascii', errors='ignore').decode('utf-8')
+
+
+def compile_reglas(reglas):
+    pasos = []
+    for regla, patron, nuevo in reglas:
+        if regla == 'minusculas':
+            pasos.append(str.lower)
+        elif regla == 'ascii':
+            pasos.append(to_ascii)
+        elif regla == 'igual':
+            pasos.append(lambda x, patron=patron, nuevo=nuevo: nuevo if x == patron else x)
+        elif regla == 'contiene':
+            pasos.append(lambda x, patron=re.compile(patron), nuevo=nuevo: nuevo if patron.search(x) else x)
+        elif regla == 'reemplazar':
+            pasos.append(lambda x, patron=re.compile(patron), nuevo=nuevo: patron.sub(nuevo, x))
+        else:
+            raise ValueError('regla desconocida: {}'.format(regla))
+
+    def normalizar(x):
+        # como los metodos .str de pandas, lo que no es texto queda vacio
+        if not isinstance(x, str):
+            return np.nan
+        for paso in pasos:
+            x = paso(x)
+        return x
+
+    return normalizar
+
+
+def normalize(serie, columna=None, reglas=REGLAS):
+    normalizar = compile_reglas(reglas[columna or serie.name])
+    codigos, unicos = pd.factorize(serie)
+    nuevos = pd.Series([normalizar(x) for x in unicos], dtype=object)
+    nuevos_codigos, categorias = pd.factorize(nuevos, sort=True)
+    codigos = np.where(codigos >= 0, nuevos_codigos[codigos], -1)
+    return pd.Series(pd.Categorical.from_codes(codigos, categories=categorias), index=serie.index, name=serie.name)
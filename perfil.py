@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import uuid
+import threading
+import functools
+import numpy as np
+from contextlib import contextmanager
+
+# Modo de perfilado opcional. Cada etapa de carga, limpieza y grafico se envuelve
+# en un span con nombre que registra tiempo, filas de entrada/salida, delta de
+# memoria del proceso y, para las funciones cacheadas, si hubo hit o miss.
+#
+# Se activa por sesion con ?perfil=1 o para todo el proceso con
+# DASHBOARD_PERFIL=1. Con DASHBOARD_PERFIL_ARCHIVO los registros de cada
+# ejecucion se agregan como JSON lines a ese archivo.
+#
+# El estado es por hilo: streamlit ejecuta cada sesion en su propio hilo. La
+# memoria es la del proceso completo, asi que con varias sesiones a la vez el
+# delta es aproximado.
+
+VARIABLE = 'DASHBOARD_PERFIL'
+
+VARIABLE_ARCHIVO = 'DASHBOARD_PERFIL_ARCHIVO'
+
+local = threading.local()
+
+
+def activo():
+    return getattr(local, 'activo', False)
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/2**20
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/2**10
+
+
+def filas(x):
+    # escalares de numpy tambien tienen shape
+    return len(x) if hasattr(x, 'shape') and np.ndim(x) > 0 else None
+
+
+def start(activar=False):
+    local.activo = activar or os.environ.get(VARIABLE, '') not in ('', '0')
+    local.registros = []
+    local.pila = []
+
+
+@contextmanager
+def span(nombre, filas_entrada=None, cache=False):
+    if not activo():
+        yield {}
+        return
+    registro = {'etapa': nombre,
+                'nivel': len(local.pila),
+                'segundos': None,
+                'filas_entrada': filas_entrada,
+                'filas_salida': None,
+                'mem_delta_mb': None,
+                'cache': 'hit' if cache else None}
+    local.registros.append(registro)
+    local.pila.append(registro)
+    memoria = rss_mb()
+    inicio = time.perf_counter()
+    try:
+        yield registro
+    finally:
+        registro['segundos'] = round(time.perf_counter()-inicio, 4)
+        registro['mem_delta_mb'] = round(rss_mb()-memoria, 1)
+        local.pila.pop()
+
+
+def miss():
+    # llamado desde dentro de una funcion cacheada: solo corre si no hubo hit
+    if activo():
+        for registro in reversed(local.pila):
+            if registro['cache'] is not None:
+                registro['cache'] = 'miss'
+                break
+
+
+def medir(nombre=None, cache=False):
+    def envolver(funcion):
+        @functools.wraps(funcion)
+        def medida(*args, **kwargs):
+            if not activo():
+                return funcion(*args, **kwargs)
+            with span(nombre or funcion.__name__, filas(args[0]) if args else None, cache) as registro:
+                resultado = funcion(*args, **kwargs)
+                registro['filas_salida'] = filas(resultado)
+            return resultado
+        return medida
+    return envolver
+
+
+def cache(decorador, **opciones):
+    # envuelve st.cache_data / st.cache_resource marcando hit o miss
+    def envolver(funcion):
+        @functools.wraps(funcion)
+        def calcular(*args, **kwargs):
+            miss()
+            return funcion(*args, **kwargs)
+        cacheada = decorador(**opciones)(calcular) if opciones else decorador(calcular)
+        return medir(funcion.__name__, cache=True)(cacheada)
+    return envolver
+
+
+def finish(archivo=None):
+    registros = getattr(local, 'registros', [])
+    local.activo = False
+    archivo = archivo or os.environ.get(VARIABLE_ARCHIVO)
+    if registros and archivo:
+        corrida = {'corrida': uuid.uuid4().hex, 'fecha': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        with open(archivo, 'a') as f:
+            for registro in registros:
+                f.write(json.dumps(dict(corrida, **registro)) + '\n')
+    return registros
@@ -0,0 +1,138 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import pyarrow.feather as feather
+import datos
+import calculos
+
+# Precalculo en lote: calcula el desglose de costos, la tabla del mapa y los
+# KPI de cada (marca, año) en un pool de procesos y los guarda en
+# RESULTADOS_DIR junto con la clave de los datos de origen. El dashboard lee
+# ese almacen al arrancar y solo calcula lo que no encuentra ahi.
+#
+#   python precalculo.py --procesos 8
+#
+# Cada proceso lee el snapshot de datos.py con memory map, asi las tablas se
+# comparten entre procesos a traves del cache de paginas del sistema.
+
+RESULTADOS_DIR = '.resultados'
+
+TABLAS = {'breakdown': ['marca', 'year'], 'mapa': ['year']}
+
+# mismas opciones que el dashboard
+pd.set_option('mode.copy_on_write', True)
+
+contexto = None
+
+
+def init_worker(path, key):
+    global contexto
+    contexto = calculos.load_contexto(path, key)
+
+
+def compute_par(par):
+    marca, year = par
+    cubo = contexto.datos['cubo']
+    return {'par': [marca, year],
+            'breakdown': calculos.breakdown(contexto, marca, year).assign(marca=marca, year=year),
+            'mapa': calculos.mapa(contexto, marca, year).assign(year=year),
+            # la variacion de kpis_marca solo es correcta para el ultimo año
+            'kpis': calculos.kpis_marca(cubo, marca, year) if year == calculos.ultimo_year(contexto) else None}
+
+
+def write_resultados(key, resultados, resumen, path='.'):
+    # se escribe en un directorio temporal y se reemplaza completo
+    destino = os.path.join(path, RESULTADOS_DIR)
+    tmp = destino + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for x in TABLAS:
+        partes = [r[x] for r in resultados if len(r[x])]
+        if partes:
+            dd = pd.concat(partes, ignore_index=True)
+            dd.to_feather(os.path.join(tmp, x + '.arrow'), compression='uncompressed')
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump({'key': key,
+                   'prep_version': datos.PREP_VERSION,
+                   'creado': pd.Timestamp.now().isoformat(timespec='seconds'),
+                   'pares': [r['par'] for r in resultados],
+                   'kpis': [[r['par'], r['kpis']] for r in resultados if r['kpis'] is not None],
+                   'resumen': resumen}, f)
+    shutil.rmtree(destino, ignore_errors=True)
+    os.replace(tmp, destino)
+
+
+def read_resultados(key, path='.'):
+    destino = os.path.join(path, RESULTADOS_DIR)
+    try:
+        with open(os.path.join(destino, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('key') != key:
+        return None
+    resultados = {'pares': {tuple(x) for x in manifest['pares']},
+                  'kpis': {tuple(par): x for par, x in manifest['kpis']},
+                  'resumen': manifest['resumen']}
+    for x, columnas in TABLAS.items():
+        try:
+            dd = feather.read_table(os.path.join(destino, x + '.arrow'), memory_map=True).to_pandas()
+        except OSError:
+            resultados[x] = {}
+            continue
+        resultados[x] = {(marca, year): df.drop(columns=columnas).reset_index(drop=True)
+                         for (marca, year), df in dd.groupby(['marca', 'year'], observed=True)}
+        resultados[x + '_vacio'] = dd.iloc[:0].drop(columns=columnas)
+    return resultados
+
+
+def lookup(resultados, tabla, marca, year):
+    # None si el par no se precalculo; un frame vacio si se calculo y no tiene filas
+    if resultados is None or (marca, year) not in resultados['pares']:
+        return None
+    dd = resultados[tabla].get((marca, year))
+    if dd is None:
+        return resultados.get(tabla + '_vacio', pd.DataFrame())
+    return dd
+
+
+def precompute(path='.', procesos=None, marcas=None, years=None):
+    key = datos.source_key(path)
+    # el padre arma el snapshot una vez, leyendo los libros con un proceso por
+    # CPU (aqui todavia no hay hilos, ver datos.pool_libros); los procesos solo
+    # lo leen
+    principal = calculos.load_contexto(path, key, procesos or datos.cpus())
+    ventas = principal.datos['ventas']
+    marcas = marcas or sorted(ventas['marca'].dropna().unique())
+    years = years or sorted(int(x) for x in ventas['year'].unique())
+    pares = [(marca, year) for marca in marcas for year in years]
+
+    year = calculos.ultimo_year(principal)
+    resumen = dict(calculos.kpis_resumen(principal.datos['cubo'], calculos.utilidad_year(principal, year), year), year=year)
+
+    with ProcessPoolExecutor(procesos, initializer=init_worker, initargs=(path, key)) as pool:
+        resultados = list(pool.map(compute_par, pares, chunksize=max(1, len(pares)//(4*(procesos or os.cpu_count())))))
+
+    write_resultados(key, resultados, resumen, path)
+    return resultados
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Precalcula los resultados del dashboard por (marca, año)')
+    parser.add_argument('--path', default='.')
+    parser.add_argument('--procesos', type=int, default=None)
+    parser.add_argument('--marcas', nargs='+')
+    parser.add_argument('--years', type=int, nargs='+')
+    args = parser.parse_args(argv)
+
+    resultados = precompute(args.path, args.procesos, args.marcas, args.years)
+    print('{} pares (marca, año) en {}'.format(len(resultados), os.path.join(args.path, RESULTADOS_DIR)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
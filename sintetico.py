@@ -0,0 +1,192 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Generador de datos sinteticos con el mismo formato que devuelve read_excel
+# para cada libro fuente, para medir el pipeline a volumenes de produccion.
+# El tamaño se da en filas de ventas; compras y cuentas por cobrar escalan
+# con el, y la lista de materiales tiene `niveles` niveles de mezclas MP.
+
+MARCAS = ['Presidente', 'PRESIDENCIAL', 'Quorhum', 'QUORHUM 12', 'Opthimus', 'Punta Cana Club',
+          'Cubaney', 'Cubaney Elixir', 'Bavaro Premiun', 'Pirathas']
+
+MONEDAS = ['EUR', 'USD', 'RD$', 'SEK', 'DKK']
+
+DESDE = pd.Timestamp('2021-01-01')
+HASTA = pd.Timestamp('2023-09-30')
+
+
+def pick(rng, valores, n):
+    valores = np.asarray(valores, dtype=object)
+    return valores[rng.integers(0, len(valores), n)]
+
+
+def fechas(rng, n):
+    dias = pd.date_range(DESDE, HASTA, freq='D')
+    codigos = rng.integers(0, len(dias), n)
+    return dias[codigos], np.asarray(dias.strftime('%d/%m/%Y'), dtype=object)[codigos]
+
+
+def make_paises(n_paises):
+    nombres = ['Pais {:02d}'.format(i) for i in range(n_paises)]
+    country_codes = pd.DataFrame({'pais': nombres, 'alpha-3': ['P{:02d}'.format(i) for i in range(n_paises)]})
+    market_share = pd.DataFrame({'pais': nombres,
+                                 'aa_per_capita': np.linspace(2, 12, n_paises).round(2),
+                                 'population': np.linspace(1e5, 8e7, n_paises).astype('int64')})
+    return country_codes, market_share
+
+
+def make_bom(rng, n_skus, niveles):
+    # SKU -> ME (hojas) + una mezcla MP de nivel 1; cada mezcla de nivel k se
+    # arma con mezclas del nivel k+1 y las del ultimo nivel son hojas
+    skus = ['BPT{:06d}'.format(i) for i in range(n_skus)]
+    me = ['ME{:05d}'.format(i) for i in range(max(10, n_skus//2))]
+    mp = [['MP{:02d}{:05d}'.format(k, i) for i in range(max(5, n_skus//10))] for k in range(1, niveles+1)]
+
+    padres, hijos, cantidad = [], [], []
+    for sku in skus:
+        for x in pick(rng, me, rng.integers(2, 5)):
+            padres.append(sku); hijos.append(x); cantidad.append(1.0)
+        padres.append(sku); hijos.append(pick(rng, mp[0], 1)[0]); cantidad.append(0.7)
+    for k in range(niveles-1):
+        for x in mp[k]:
+            for y in pick(rng, mp[k+1], rng.integers(2, 4)):
+                padres.append(x); hijos.append(y); cantidad.append(float(rng.uniform(1, 100)))
+
+    bom = pd.DataFrame({'#': np.arange(1, len(padres)+1),
+                        'Artículo superior': padres,
+                        'Descripción de producto': padres,
+                        'Artículo superior.1': hijos,
+                        'ITEMNAME': hijos,
+                        'Quantity': cantidad,
+                        'Unnamed: 6': 'Y'}).drop_duplicates(subset=['Artículo superior', 'Artículo superior.1'])
+    return bom, skus, me + mp[-1]
+
+
+def make_ventas(rng, n, skus, clientes, paises):
+    n_ap = n//20
+    n_sku = n - n_ap
+    sku_marca = pick(rng, MARCAS, len(skus))
+    sku_articulo = np.asarray(['Ron {} {} 40° (1/700 ml)'.format(m, s) for m, s in zip(sku_marca, skus)], dtype=object)
+    sku_precio = rng.uniform(4, 40, len(skus))
+
+    i = rng.integers(0, len(skus), n)
+    codigo = np.asarray(skus, dtype=object)[i]
+    articulo = sku_articulo[i]
+    cantidad = rng.integers(1, 120, n).astype(float)
+    monto = cantidad*sku_precio[i]*rng.uniform(0.9, 1.1, n)
+
+    # descuentos y A&P: sin codigo ni cantidad, monto negativo
+    codigo[n_sku:] = np.nan
+    articulo[n_sku:] = 'Descuento Degustacion'
+    articulo[n_sku:n_sku+min(10, n_ap)] = 'MIGRACION A SAP 30/09/2021'
+    cantidad[n_sku:] = 0
+    monto[n_sku:] = -rng.uniform(100, 5000, n_ap)
+
+    dias, textos = fechas(rng, n)
+    j = rng.integers(0, len(clientes), n)
+    return pd.DataFrame({'pais': pick(rng, paises, n),
+                         'codigo_cliente': np.asarray(['C{:05d}'.format(x) for x in range(len(clientes))], dtype=object)[j],
+                         'cliente': np.asarray(clientes, dtype=object)[j],
+                         'familia': sku_marca[i],
+                         'fecha': textos,
+                         'month': dias.month.to_numpy(),
+                         'day': dias.day.to_numpy(),
+                         'year': dias.year.to_numpy(),
+                         'codigo': codigo,
+                         'articulo': articulo,
+                         'cantidad': cantidad,
+                         'monto': monto.round(2)})
+
+
+def make_compras(rng, n, componentes):
+    # una decima parte de los componentes nunca se compra: sale de faltantes
+    comprados = componentes[:max(1, len(componentes)*9//10)]
+    _, textos = fechas(rng, n)
+    return pd.DataFrame({'#': np.arange(1, n+1),
+                         'Num_Factura': rng.integers(1000000, 2000000, n),
+                         'Fecha': textos,
+                         'Proveedor': pick(rng, ['PROVEEDOR {}'.format(x) for x in range(40)], n),
+                         'Codigo_Articulo': pick(rng, comprados, n),
+                         'Nombre_Articulo': 'componente',
+                         'Cantidad': rng.integers(100, 50000, n).astype(float),
+                         'Moneda del precio': pick(rng, MONEDAS, n),
+                         'Precio': rng.uniform(0.01, 20, n).round(5),
+                         'Etapa': np.nan,
+                         'Unnamed: 10': 'Y'})
+
+
+def make_lista(rng, componentes):
+    n = len(componentes)
+    return pd.DataFrame({'#': np.arange(1, n+1),
+                         'Número de artículo': componentes,
+                         'Descripción del artículo': componentes,
+                         'En stock': rng.uniform(0, 50000, n),
+                         'Código de barras': np.nan,
+                         'Grupo de artículos': 'Material',
+                         'Fabricante': '- Ningún fabricante -',
+                         'Unidad de medida de inventario': np.nan,
+                         'Últm.precio revalorización (moneda)': 'RD$',
+                         'Últm.precio revalorización': rng.uniform(1, 500, n),
+                         'Último precio de compra (moneda)': pick(rng, ['RD$', 'EUR', 'USD'], n),
+                         'Último precio de compra': rng.uniform(0.01, 20, n).round(5)})
+
+
+def make_cxc(rng, n, clientes):
+    _, textos = fechas(rng, n)
+    facturado = rng.uniform(1000, 2000000, n).round(2)
+    pagado = np.where(rng.random(n) < 0.8, facturado, (facturado*rng.random(n)).round(2))
+    j = rng.integers(0, len(clientes), n)
+    return pd.DataFrame({'#': np.arange(1, n+1),
+                         'No. Factura': np.arange(1000001, 1000001+n),
+                         'Fecha': textos,
+                         'Codigo Cliente': np.asarray(['C{:05d}'.format(x) for x in range(len(clientes))], dtype=object)[j],
+                         'Cliente': np.asarray(clientes, dtype=object)[j],
+                         'Total Facturado': facturado,
+                         'Total Pagado': pagado,
+                         'Total Pendiente': facturado-pagado,
+                         'Fecha.1': textos,
+                         'Unnamed: 9': 'Y'})
+
+
+def make_condiciones(rng, clientes):
+    n = len(clientes)
+    return pd.DataFrame({'#': np.arange(1, n+1),
+                         'Código SN': ['C{:05d}'.format(x) for x in range(n)],
+                         'Nombre SN': clientes,
+                         'Código de condiciones de pago': 2,
+                         'Código de condiciones de pago.1': pick(rng, ['Contado', '15 Días', '30 Días', '60 Días', '90 Días'], n),
+                         'Nombre de la lista de precios': 'LISTA DE PRECIOS GENÉRICA',
+                         'Unnamed: 6': 'Y'})
+
+
+def make_fuentes(filas, niveles=5, seed=0):
+    rng = np.random.default_rng(seed)
+    n_skus = max(20, int(np.sqrt(filas)))
+    clientes = ['Cliente {} SRL'.format(x) for x in range(max(20, n_skus//4))]
+    country_codes, market_share = make_paises(40)
+    bom, skus, hojas = make_bom(rng, n_skus, niveles)
+    me = [x for x in hojas if 'ME' in x]
+    mp = [x for x in hojas if 'MP' in x]
+    return {
+        'ventas.xlsx': make_ventas(rng, filas, skus, clientes, country_codes['pais']),
+        'compras.xlsx': make_compras(rng, max(1000, filas//5), hojas),
+        'costo_me.xlsx': make_lista(rng, me),
+        'costo_mp.xlsx': make_lista(rng, mp),
+        'costo_me_faltantes.xlsx': pd.DataFrame({'id_item': ['me9{:04d}'.format(x) for x in range(16)],
+                                                 'moneda': 'usd',
+                                                 'precio': rng.uniform(0.01, 5, 16)}),
+        'bill_of_materials.xlsx': bom,
+        'market_share.xlsx': market_share,
+        'cuentas_por_cobrar.xlsx': make_cxc(rng, max(1000, filas//10), clientes),
+        'condiciones.xlsx': make_condiciones(rng, clientes),
+        'all.csv': country_codes,
+    }
+
+
+def write_fuentes(fuentes, path):
+    for x, dd in fuentes.items():
+        if x.endswith('.csv'):
+            dd.to_csv(os.path.join(path, x), index=False)
+        else:
+            dd.to_excel(os.path.join(path, x), index=False)